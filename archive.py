@@ -0,0 +1,102 @@
+# coding: utf-8
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from requests.structures import CaseInsensitiveDict
+from stats import stats
+
+
+class NotArchived(Exception):
+    pass
+
+
+class ArchivedResponse(object):
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+
+
+class Archive(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                         "url TEXT PRIMARY KEY, status INTEGER, headers TEXT, body BLOB, recorded REAL)")
+        self._db.commit()
+
+    def put(self, url, response):
+        body = zlib.compress(response.content)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                             (url, response.status_code, json.dumps(dict(response.headers)),
+                              sqlite3.Binary(body), time.time()))
+            self._db.commit()
+        stats.count("archive", "recorded")
+        stats.count("archive", "compressed_bytes", len(body))
+
+    def get(self, url):
+        with self._lock:
+            row = self._db.execute("SELECT status, headers, body FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        status, headers, body = row
+        return ArchivedResponse(url, status, json.loads(headers), zlib.decompress(bytes(body)))
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RecordingClient(object):
+
+    def __init__(self, client, archive):
+        self.client = client
+        self.archive = archive
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def get(self, url, conditional=False, **kwargs):
+        response = self.client.get(url, **kwargs)
+        if response.status_code == 200:
+            self.archive.put(url, response)
+        return response
+
+    def close(self):
+        self.client.close()
+        self.archive.close()
+
+
+class ReplayClient(object):
+
+    limiter = None
+
+    def __init__(self, archive):
+        self.archive = archive
+
+    def get(self, url, conditional=False, **kwargs):
+        response = self.archive.get(url)
+        if response is None:
+            stats.count("archive", "misses")
+            raise NotArchived(url)
+        stats.count("archive", "replayed")
+        return response
+
+    def commit(self, urls):
+        pass
+
+    def close(self):
+        self.archive.close()
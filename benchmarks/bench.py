@@ -0,0 +1,232 @@
+# coding: utf-8
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from multiprocessing import Process, Queue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+sys.path.insert(0, ROOT)
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from sites import Registry
+from storage import BatchWriter
+
+HTML = "text/html; charset=utf-8"
+JSON = "application/json; charset=utf-8"
+
+ROUTES = [
+    ("http://neihanshequ.com/joke/", "neihan.json", JSON),
+    ("http://3g.163.com/touch/jsonp/joke/", "netease.json", JSON),
+    ("http://m2.qiushibaike.com/article/list/", "qiushi.json", JSON),
+    ("http://www.xxhh.com/duanzi/", "xiha.html", HTML),
+    ("http://dg.xxhh.com/getcnums/", "xiha_meta.json", JSON),
+    ("http://www.pengfu.com/", "pengfu.html", HTML),
+    ("http://www.waduanzi.com/", "waduanzi.html", HTML),
+    ("http://dg.xxhh.com/api/v2/getComment.php", "comment_xiha.json", JSON),
+    ("http://neihanshequ.com/m/api/get_essay_comments/", "comment_neihan.json", JSON),
+    ("http://comment.api.163.com/", "comment_netease.json", JSON),
+    ("http://api1.pengfu.com/humor/getComments", "comment_pengfu.json", JSON),
+]
+
+SPIDERS = ["neihan", "netease", "qiushi", "xixihaha", "pengfu", "waduanzi"]
+
+COMMENTS = [
+    ("xixihaha", {"code": "700000"}),
+    ("neihan", {"code": "5000000000", "comment_count": 20}),
+    ("netease", {"code": "CE2OUGTG9000UGTH"}),
+    ("pengfu", {"code": "1600000"}),
+]
+
+registry = Registry()
+
+
+class FixtureResponse(object):
+
+    def __init__(self, content, content_type):
+        self.status_code = 200
+        self.content = content
+        self.headers = {"content-type": content_type}
+
+
+class FixtureClient(object):
+
+    def __init__(self):
+        self.cache = dict()
+
+    def get(self, url, conditional=False, **kwargs):
+        for prefix, name, content_type in ROUTES:
+            if url.startswith(prefix):
+                if name not in self.cache:
+                    with open(os.path.join(FIXTURES, name), "rb") as f:
+                        self.cache[name] = f.read()
+                return FixtureResponse(self.cache[name], content_type)
+        raise KeyError("no fixture for %s" % url)
+
+
+class MemoryCollection(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.uniques = dict()
+        self.counter = 0
+
+    def _insert(self, document):
+        if document["unique"] in self.uniques:
+            raise DuplicateKeyError("E11000 duplicate key %s" % document["unique"], 11000)
+        self.counter += 1
+        document.setdefault("_id", self.counter)
+        self.uniques[document["unique"]] = document
+        return document["_id"]
+
+    def insert_one(self, document):
+        class Result(object):
+            inserted_id = self._insert(document)
+        return Result()
+
+    def insert_many(self, documents, ordered=True):
+        errors = list()
+        for index, document in enumerate(documents):
+            try:
+                self._insert(document)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+def measure(func, iterations):
+    latencies = list()
+    items = 0
+    for _ in range(iterations):
+        start = time.time()
+        items += func()
+        latencies.append(time.time() - start)
+    total = sum(latencies)
+    latencies.sort()
+    per_iteration = float(items) / iterations if iterations else 0
+    return {
+        "iterations": iterations,
+        "items": items,
+        "seconds": total,
+        "items_per_sec": items / total if total else 0,
+        "item_latency_us": total / items * 1e6 if items else 0,
+        "p95_item_latency_us": latencies[int(len(latencies) * 0.95) - 1] / per_iteration * 1e6 if items else 0,
+    }
+
+
+def spider_pages(client):
+    for key in SPIDERS:
+        site = registry.get(key)
+        spider = site.spider().with_client(client)
+        yield spider, spider.page_url(site.url, 1)
+
+
+def spider_cases(client):
+    for spider, url in spider_pages(client):
+        document = spider.prepare(spider.download(url, c_json=spider.r_json))
+        yield "parse.%s" % spider.__name__, lambda s=spider, d=document: sum(1 for _ in s.parse(d))
+
+
+def comment_cases(client):
+    for key, comment_need in COMMENTS:
+        cls = registry.get(key).comments()
+        comment = type(cls.__name__, (cls,), {"joke": "bench", "client": client})
+        documents = [comment.download(url, c_json=comment.r_json, skip=comment.skip)
+                     for url in comment.get_urls(comment_need)]
+        yield ("parse.%s" % cls.__name__,
+               lambda c=comment, ds=documents: sum(1 for d in ds for _ in c.parse(d)))
+
+
+def store_cases(client):
+    jokes = list()
+    for spider, url in spider_pages(client):
+        jokes.extend(spider.run(url))
+
+    def store_one():
+        collection = MemoryCollection("jokes")
+        for joke in jokes + jokes:
+            joke.store(collection)
+        return len(jokes) * 2
+
+    def store_batch():
+        writer = BatchWriter(MemoryCollection("jokes"), batch_size=100)
+        writer.write(jokes + jokes)
+        return len(jokes) * 2
+
+    yield "store.Joke.store", store_one
+    yield "store.BatchWriter.write", store_batch
+
+
+def upload_cases(client):
+    site = registry.get("pengfu")
+    jokes = list(site.spider().with_client(client).run(site.url.format(page=1)))
+    documents = list()
+    collection = MemoryCollection("jokes")
+    for joke in jokes:
+        document = joke.to_document()
+        collection._insert(document)
+        documents.append((joke, document))
+    comments = list(site.comments().with_client(client).run("bench", {"code": "1600000"}))
+    comment_documents = [(comment, comment.to_document()) for comment in comments]
+    yield "upload.joke_payload", lambda: len([j.to_upload_payload(d, site.online_source_id) for j, d in documents])
+    yield "upload.comment_payload", lambda: len([c.to_upload_payload(d) for c, d in comment_documents])
+
+
+CASES = [spider_cases, comment_cases, store_cases, upload_cases]
+
+
+def run_case(name, iterations, queue):
+    client = FixtureClient()
+    for group in CASES:
+        for name_, func in group(client):
+            if name_ == name:
+                baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                func()
+                result = measure(func, iterations)
+                result["baseline_rss_kb"] = baseline
+                result["peak_rss_growth_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+                queue.put(result)
+                return
+    queue.put(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline benchmarks for spiders, comments, store and upload")
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    parser.add_argument("-o", "--output", help="write json results to this file instead of stdout")
+    parser.add_argument("-k", "--only", help="run cases whose name contains this string")
+    args = parser.parse_args()
+    client = FixtureClient()
+    names = [name for group in CASES for name, _ in group(client)]
+    results = dict()
+    for name in names:
+        if args.only and args.only not in name:
+            continue
+        queue = Queue()
+        process = Process(target=run_case, args=(name, args.iterations, queue))
+        process.start()
+        results[name] = queue.get()
+        process.join()
+    report = {
+        "python": sys.version.split()[0],
+        "iterations": args.iterations,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
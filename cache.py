@@ -0,0 +1,113 @@
+# coding: utf-8
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+class HttpCache(object):
+
+    def __init__(self, directory, max_bytes=32 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = dict()
+        self._pending = dict()
+        self._size = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            self._index[name] = (stat.st_size, stat.st_mtime)
+            self._size += stat.st_size
+
+    @staticmethod
+    def _name(url):
+        if isinstance(url, unicode):
+            url = url.encode("utf-8")
+        return hashlib.md5(url).hexdigest()
+
+    def get(self, url):
+        name = self._name(url)
+        with self._lock:
+            if name not in self._index:
+                return None
+        try:
+            with open(os.path.join(self.directory, name)) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def touch(self, url):
+        name = self._name(url)
+        now = time.time()
+        with self._lock:
+            if name not in self._index:
+                return
+            self._index[name] = (self._index[name][0], now)
+        try:
+            os.utime(os.path.join(self.directory, name), (now, now))
+        except OSError:
+            pass
+
+    def hold(self, url, response):
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+        with self._lock:
+            if etag or last_modified:
+                self._pending[url] = (etag, last_modified)
+            else:
+                self._pending.pop(url, None)
+
+    def commit(self, url):
+        with self._lock:
+            validators = self._pending.pop(url, None)
+        if validators:
+            self.put(url, *validators)
+
+    def put(self, url, etag, last_modified):
+        name = self._name(url)
+        data = json.dumps({"url": url, "etag": etag, "last_modified": last_modified})
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            with open(path + ".tmp", "w") as f:
+                f.write(data)
+            os.rename(path + ".tmp", path)
+            size, _ = self._index.get(name, (0, 0))
+            self._index[name] = (len(data), time.time())
+            self._size += len(data) - size
+            self._evict()
+
+    def _evict(self):
+        if self._size <= self.max_bytes:
+            return
+        names = sorted(self._index, key=lambda n: self._index[n][1])
+        for name in names:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            size, _ = self._index.pop(name)
+            self._size -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        logging.info("http cache evict to %s bytes" % self._size)
+
+    def validators(self, url):
+        entry = self.get(url)
+        headers = dict()
+        if not entry:
+            return headers
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
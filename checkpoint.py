@@ -0,0 +1,68 @@
+# coding: utf-8
+
+import json
+import logging
+import os
+import threading
+
+RESOLVED = ("processed", "sent", "spooled", "failed")
+
+
+class Checkpoint(object):
+
+    def __init__(self, path, resolved=RESOLVED):
+        self.path = path
+        self.resolved = resolved
+        self._lock = threading.Lock()
+        self._state = dict()
+        self._file = None
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        kind, key, stage, data = json.loads(line)
+                    except ValueError:
+                        logging.warn("checkpoint %s: skip broken line" % self.path)
+                        continue
+                    self._state[(kind, key)] = (stage, data)
+        self._file = open(self.path, "a")
+        return self
+
+    def compact(self, drop=()):
+        with self._lock:
+            for item, (stage, _) in list(self._state.items()):
+                if stage in self.resolved or item[0] in drop:
+                    del self._state[item]
+            if self._file:
+                self._file.close()
+            tmp = "%s.tmp" % self.path
+            with open(tmp, "w") as f:
+                for (kind, key), (stage, data) in self._state.items():
+                    f.write(json.dumps([kind, key, stage, data]) + "\n")
+            os.rename(tmp, self.path)
+            self._file = open(self.path, "a")
+
+    def mark(self, kind, keys, stage, data=None):
+        if not isinstance(keys, (list, tuple)):
+            keys = [keys]
+        with self._lock:
+            for key in keys:
+                self._state[(kind, key)] = (stage, data)
+                self._file.write(json.dumps([kind, key, stage, data]) + "\n")
+            self._file.flush()
+
+    def stage(self, kind, key):
+        return self._state.get((kind, key), (None, None))
+
+    def pending(self, kind, stage):
+        with self._lock:
+            return [(key, data) for (kind_, key), (stage_, data) in self._state.items()
+                    if kind_ == kind and stage_ == stage]
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
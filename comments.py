@@ -4,19 +4,27 @@ import logging
 import json
 import hashlib
 from types import UnicodeType
-from datetime import datetime
-import requests
-from w3lib.encoding import html_to_unicode
+from datetime import datetime, timedelta
+from engine import imap_unordered
+from logqueue import SAMPLE
+from stats import stats
+from extract import charsets
+from transport import NotModified, default_client
 from pymongo.errors import DuplicateKeyError
 
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
 
 class JokeComment(object):
-    def __init__(self):
-        self.joke = None
-        self.author = None
-        self.avatar = None
-        self.content = None
-        self.n_like = 0
+
+    __slots__ = ("joke", "author", "avatar", "content", "n_like")
+
+    def __init__(self, joke=None, author=None, avatar=None, content=None, n_like=0):
+        self.joke = joke
+        self.author = author
+        self.avatar = avatar
+        self.content = content
+        self.n_like = n_like
 
     def show(self):
         print("joke: %s" % self.joke)
@@ -32,19 +40,36 @@ class JokeComment(object):
             string = string.encode("utf-8")
         return hashlib.md5(string).hexdigest()
 
-    def store(self, collection):
+    def digest(self):
+        return self.unique("%s%s" % (self.author, self.content))
+
+    def to_document(self):
         if not (self.author or self.avatar or self.content):
             logging.warn("joke-comment miss fields author: %s, avatar: %s content: %s"
                          % (self.author, self.avatar, self.content))
-        document = dict()
-        document["joke"] = self.joke
-        document["author"] = self.author
-        document["avatar"] = self.avatar
-        document["content"] = self.content
-        document["n_like"] = int(self.n_like)
-        document["insert"] = datetime.utcnow()
-        unique_text = "%s%s" % (document["author"], document["content"])
-        document["unique"] = self.unique(unique_text)
+        return {
+            "joke": self.joke,
+            "author": self.author,
+            "avatar": self.avatar,
+            "content": self.content,
+            "n_like": self.n_like,
+            "insert": datetime.utcnow(),
+            "unique": self.digest(),
+        }
+
+    def to_upload_payload(self, document):
+        return {
+            "content": self.content,
+            "commend": self.n_like,
+            "insert_time": (document["insert"] + timedelta(hours=8)).strftime(TIME_FORMAT),
+            "user_name": self.author,
+            "avatar": self.avatar,
+            "foreign_id": self.joke,
+            "unique_id": document["unique"],
+        }
+
+    def store(self, collection):
+        document = self.to_document()
         try:
             result = collection.insert_one(document)
         except DuplicateKeyError:
@@ -52,7 +77,7 @@ class JokeComment(object):
         except Exception as e:
             logging.error(e.message, exc_info=True)
         else:
-            logging.info("store joke-comment id: %s" % result.inserted_id)
+            logging.info("store joke-comment id: %s" % result.inserted_id, extra=SAMPLE)
             return result.inserted_id
 
 
@@ -61,59 +86,80 @@ class CommentBase(object):
     headers = {
         "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.86 Safari/537.36"}
     timeout = 30
+    client = None
     r_json = True
     skip = None
     joke = None
+    page_workers = 4
+
+    @classmethod
+    def with_client(cls, client):
+        return type(cls.__name__, (cls,), {"client": client})
 
     @classmethod
-    def download(cls, url, c_json=False, skip=None, headers=None):
+    def download(cls, url, c_json=False, skip=None, headers=None, conditional=False):
         if headers is None:
             headers = cls.headers
-        response = requests.get(url, headers=headers, timeout=(10, cls.timeout))
+        client = cls.client or default_client()
+        try:
+            with stats.timer(cls.__name__, "download"):
+                response = client.get(url, conditional=conditional, headers=headers, timeout=(10, cls.timeout))
+        except Exception:
+            stats.count(cls.__name__, "errors")
+            raise
+        if response.status_code == 304:
+            stats.count(cls.__name__, "not_modified")
+            raise NotModified(url)
         content = response.content
+        stats.count(cls.__name__, "bytes", len(content))
         if skip:
             content = content[skip[0]:skip[1]]
-        if c_json:
-            return json.loads(content)
-        else:
-            _, content = html_to_unicode(
-                content_type_header=response.headers.get("content-type"),
-                html_body_str=content
-            )
-            return content.encode("utf-8")
+        with stats.timer(cls.__name__, "decode"):
+            if c_json:
+                return json.loads(content)
+            else:
+                return charsets.document(url, response.headers.get("content-type"), content)
 
     @classmethod
     def get_urls(cls, comment_need):
         return list()
 
+    @classmethod
+    def get_pages(cls, comment_need):
+        return [(url, None) for url in cls.get_urls(comment_need)]
+
+    @classmethod
+    def fetch(cls, page):
+        url, document = page
+        if document is None:
+            try:
+                document = cls.download(url, c_json=cls.r_json, skip=cls.skip, headers=cls.headers,
+                                        conditional=True)
+            except NotModified:
+                logging.info("comment page not modified: %s" % url)
+                return list()
+        return list(stats.timed_iter(cls.__name__, "parse", cls.parse(document)))
+
     @classmethod
     def parse(cls, doc):
-        comments = list()
         for item in doc:
-            comment = JokeComment()
-            comment.author = None
-            comment.avatar = None
-            comment.content = None
-            comment.n_like = None
-            comment.joke = cls.joke
-            comments.append(comment)
-        return comments
-
-    @classmethod
-    def run(cls, joke_id, comment_need):
-        cls.joke = str(joke_id)
-        urls = cls.get_urls(comment_need)
-        comments = list()
-        for url in urls:
-            document = cls.download(url, c_json=cls.r_json, skip=cls.skip, headers=cls.headers)
-            comments_ = cls.parse(document)
-            comments.extend(comments_)
-        logging.info("%s: %s" % (cls.__name__, len(comments)))
-        return comments
+            yield JokeComment(joke=cls.joke)
+
+    @classmethod
+    def run(cls, joke_id, comment_need, fetched=None):
+        bound = type(cls.__name__, (cls,), {"joke": str(joke_id)})
+        pages = bound.get_pages(comment_need)
+        if fetched is not None:
+            fetched.extend(url for url, _ in pages)
+        count = 0
+        for comments in imap_unordered(bound.fetch, pages, cls.page_workers):
+            count += len(comments)
+            for comment in comments:
+                yield comment
+        logging.info("%s: %s" % (cls.__name__, count))
 
 
 class CommentXiHa(CommentBase):
-    COMMENT_URL = "http://dg.xxhh.com/api/v2/getComment.php?id={id}&sid=joke&p=1&limit=100&__jsonp__=fn"
     skip = (3, -1)
 
     @classmethod
@@ -126,20 +172,17 @@ class CommentXiHa(CommentBase):
     @classmethod
     def parse(cls, doc):
         data = doc.get("c", [])
-        comments = list()
         for item in data:
-            comment = JokeComment()
-            comment.author = item.get("mn", "匿名")
-            comment.avatar = item.get("ml")
-            comment.content = item.get("c")
-            comment.n_like = item.get("fl",0)
-            comment.joke = cls.joke
-            comments.append(comment)
-        return comments
+            yield JokeComment(
+                joke=cls.joke,
+                author=item.get("mn", "匿名"),
+                avatar=item.get("ml"),
+                content=item.get("c"),
+                n_like=int(item.get("fl", 0)),
+            )
 
 
 class CommentNeihan(CommentBase):
-    COMMENT_URL = "http://neihanshequ.com/m/api/get_essay_comments/?group_id={g_id}&offset={offset}"
     LIMIT = 20
 
     @classmethod
@@ -151,27 +194,25 @@ class CommentNeihan(CommentBase):
     @classmethod
     def parse(cls, doc):
         data = doc["data"].get("recent_comments")
-        comments = list()
         for item in data:
-            comment = JokeComment()
-            comment.joke = cls.joke
-            comment.author = item.get("user_name", "匿名")
-            comment.avatar = item.get("avatar_url")
-            comment.content = item.get("text")
-            comment.n_like = item.get("digg_count", 0)
-            comments.append(comment)
-        return comments
+            yield JokeComment(
+                joke=cls.joke,
+                author=item.get("user_name", "匿名"),
+                avatar=item.get("avatar_url"),
+                content=item.get("text"),
+                n_like=int(item.get("digg_count", 0)),
+            )
 
 
 class CommentNetEase(CommentBase):
-    COMMENT_URL = "http://comment.api.163.com/" \
-                  "api/v1/products/a2869674571f77b5a0867c3d71db5856/" \
-                  "threads/{_id}/app/comments/newList?" \
-                  "offset={offset}&limit={limit}"
     LIMIT = 40
 
     @classmethod
     def get_urls(cls, comment_need):
+        return [url for url, _ in cls.get_pages(comment_need)]
+
+    @classmethod
+    def get_pages(cls, comment_need):
         _id = comment_need["code"]
         url = cls.COMMENT_URL.format(_id=_id,
                                      offset=0,
@@ -180,11 +221,11 @@ class CommentNetEase(CommentBase):
         if not result: return list()
         count = result["newListSize"]
         pages = (count + cls.LIMIT - 1) / cls.LIMIT
-        urls = [cls.COMMENT_URL.format(_id=comment_need["code"],
-                                       offset=page * cls.LIMIT,
-                                       limit=cls.LIMIT)
-                for page in range(pages)]
-        return urls
+        if not pages: return list()
+        return [(url, result)] + [(cls.COMMENT_URL.format(_id=_id,
+                                                          offset=page * cls.LIMIT,
+                                                          limit=cls.LIMIT), None)
+                                  for page in range(1, pages)]
 
     @classmethod
     def parse(cls, doc):
@@ -192,26 +233,23 @@ class CommentNetEase(CommentBase):
         for _id in doc.get("commentIds", []):
             ids.add(_id.split(",")[0])
         _comments = doc.get("comments", {})
-        comments = list()
         for _id in ids:
-            comment = JokeComment()
-            comment.joke = cls.joke
             comment_ = _comments.get(_id)
             nickname = comment_["user"].get("nickname")
-            comment.author = nickname if nickname else None
             logo = comment_["user"].get("avatar")
             if logo and "netease.com" in logo and "noface" in logo:
                 logo = None
-            comment.avatar = logo if logo else None
             vote = comment_.get("vote")
-            comment.n_like = int(vote) if vote else 0
-            comment.content = comment_["content"]
-            comments.append(comment)
-        return comments
+            yield JokeComment(
+                joke=cls.joke,
+                author=nickname if nickname else None,
+                avatar=logo if logo else None,
+                content=comment_["content"],
+                n_like=int(vote) if vote else 0,
+            )
 
 
 class CommentPengfu(CommentBase):
-    COMMENT_URL = "http://api1.pengfu.com/humor/getComments?id={id}"
     @classmethod
     def get_urls(cls, comment_need):
         urls = list()
@@ -222,21 +260,20 @@ class CommentPengfu(CommentBase):
     @classmethod
     def parse(cls, doc):
         data = doc.get("data", [])
-        comments = list()
         for item in data:
-            comment = JokeComment()
-            comment.author = item.get("name", "匿名")
-            comment.avatar = item.get("avatar")
             content = item.get("content_json")
             if not content:continue
-            comment.content = content[0].get("comment_content")
-            comment.n_like = item.get("like",0)
-            comment.joke = cls.joke
-            comments.append(comment)
-        return comments
+            yield JokeComment(
+                joke=cls.joke,
+                author=item.get("name", "匿名"),
+                avatar=item.get("avatar"),
+                content=content[0].get("comment_content"),
+                n_like=int(item.get("like", 0)),
+            )
 
 
 if __name__ == "__main__":
-    comments = CommentNetEase.run("neihan", {"code": "CE2OUGTG9001UGTH"})
+    from sites import Registry
+    comments = Registry().get("netease").comments().run("neihan", {"code": "CE2OUGTG9001UGTH"})
     for comment in comments:
         comment.show()
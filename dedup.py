@@ -0,0 +1,97 @@
+# coding: utf-8
+
+import cPickle as pickle
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from bson import ObjectId
+
+
+class BloomFilter(object):
+
+    def __init__(self, capacity=2000000, error_rate=0.001):
+        self.size = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, int(round(self.size * math.log(2) / capacity)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, unique):
+        h1 = int(unique[:16], 16)
+        h2 = int(unique[16:32], 16) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, unique):
+        for position in self._positions(unique):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, unique):
+        for position in self._positions(unique):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class DedupIndex(object):
+
+    def __init__(self, path=None, capacity=2000000, error_rate=0.001, lru_size=200000):
+        self.path = path
+        self.lru_size = lru_size
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.recent = OrderedDict()
+        self.saved = None
+        self.started = None
+        self._lock = threading.Lock()
+
+    def add(self, unique):
+        with self._lock:
+            self.bloom.add(unique)
+            self.recent.pop(unique, None)
+            self.recent[unique] = True
+            if len(self.recent) > self.lru_size:
+                self.recent.popitem(last=False)
+
+    def seen(self, unique):
+        with self._lock:
+            if unique not in self.bloom:
+                return False
+            if self.recent.pop(unique, None) is None:
+                return False
+            self.recent[unique] = True
+            return True
+
+    def load(self):
+        if not (self.path and os.path.exists(self.path)):
+            return False
+        with open(self.path, "rb") as f:
+            state = pickle.load(f)
+        if len(state["bits"]) != len(self.bloom.bits):
+            logging.warn("dedup index %s size changed, rebuild" % self.path)
+            return False
+        self.bloom.bits = state["bits"]
+        self.recent = OrderedDict((unique, True) for unique in state["recent"][-self.lru_size:])
+        self.saved = state["saved"]
+        return True
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            state = {"bits": self.bloom.bits, "recent": list(self.recent), "saved": self.started or datetime.utcnow()}
+        tmp = "%s.%s.tmp" % (self.path, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+
+    def warm(self, *collections):
+        loaded = self.load()
+        self.started = datetime.utcnow()
+        spec = {"_id": {"$gte": ObjectId.from_datetime(self.saved)}} if loaded else {}
+        for collection in collections:
+            count = 0
+            for document in collection.find(spec, {"unique": 1, "_id": 0}).sort("_id", 1):
+                if document.get("unique"):
+                    self.add(document["unique"])
+                    count += 1
+            logging.info("dedup index warm %s: %s" % (collection.name, count))
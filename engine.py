@@ -0,0 +1,109 @@
+# coding: utf-8
+
+import logging
+import threading
+from collections import defaultdict, deque
+from Queue import Queue, Empty, Full
+
+
+class CrawlEngine(object):
+
+    def __init__(self, workers=16, site_limit=4):
+        self.workers = workers
+        self.site_limit = site_limit
+        self.site_limits = dict()
+        self._tasks = Queue()
+        self._threads = list()
+        self._lock = threading.Lock()
+        self._running = defaultdict(int)
+        self._pending = defaultdict(deque)
+
+    def limit(self, key, value):
+        self.site_limits[key] = value
+
+    def submit(self, key, func, *args, **kwargs):
+        task = (key, func, args, kwargs)
+        with self._lock:
+            if self._running[key] < self.site_limits.get(key, self.site_limit):
+                self._running[key] += 1
+                self._tasks.put(task)
+            else:
+                self._pending[key].append(task)
+
+    def _done(self, key):
+        with self._lock:
+            if self._pending[key]:
+                self._tasks.put(self._pending[key].popleft())
+            else:
+                self._running[key] -= 1
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                self._tasks.task_done()
+                return
+            key, func, args, kwargs = task
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logging.error("task %s %s failed: %s" % (key, func.__name__, e), exc_info=True)
+            finally:
+                self._done(key)
+                self._tasks.task_done()
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        self._tasks.join()
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = list()
+
+
+def imap_unordered(func, items, workers):
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield func(item)
+        return
+    tasks, results, cancelled = Queue(), Queue(maxsize=workers), threading.Event()
+    for item in items:
+        tasks.put(item)
+
+    def work():
+        while not cancelled.is_set():
+            try:
+                item = tasks.get_nowait()
+            except Empty:
+                return
+            try:
+                result = (True, func(item))
+            except Exception as e:
+                result = (False, e)
+            while not cancelled.is_set():
+                try:
+                    results.put(result, timeout=0.1)
+                    break
+                except Full:
+                    pass
+
+    for _ in range(min(workers, len(items))):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+    try:
+        for _ in items:
+            ok, value = results.get()
+            if not ok:
+                raise value
+            yield value
+    finally:
+        cancelled.set()
@@ -0,0 +1,102 @@
+# coding: utf-8
+
+import threading
+from collections import namedtuple
+from urlparse import urlparse
+from lxml import etree, html
+from lxml.cssselect import CSSSelector
+from w3lib.encoding import html_body_declared_encoding, html_to_unicode, http_content_type_encoding, read_bom
+
+SNIFF_BYTES = 4096
+
+Document = namedtuple("Document", ["body", "encoding"])
+
+_local = threading.local()
+
+
+def parser_for(encoding):
+    parsers = getattr(_local, "parsers", None)
+    if parsers is None:
+        parsers = _local.parsers = dict()
+    if encoding not in parsers:
+        parsers[encoding] = html.HTMLParser(encoding=encoding)
+    return parsers[encoding]
+
+
+class Charsets(object):
+
+    def __init__(self):
+        self._hosts = dict()
+
+    def detect(self, url, content_type, body):
+        encoding = http_content_type_encoding(content_type)
+        if encoding:
+            return encoding
+        host = urlparse(url).netloc
+        encoding = self._hosts.get(host)
+        if encoding:
+            return encoding
+        encoding = read_bom(body[:4])[0] or html_body_declared_encoding(body[:SNIFF_BYTES])
+        if encoding:
+            self._hosts[host] = encoding
+            return encoding
+        encoding, _ = html_to_unicode(content_type, body)
+        return encoding
+
+    def document(self, url, content_type, body):
+        encoding = self.detect(url, content_type, body)
+        try:
+            parser_for(encoding)
+        except LookupError:
+            _, text = html_to_unicode(content_type, body)
+            return Document(text.encode("utf-8"), "utf-8")
+        return Document(body, encoding)
+
+
+charsets = Charsets()
+
+
+class Extractor(object):
+
+    def __init__(self, selector, config):
+        self.selector = CSSSelector(selector)
+        self.config = config
+        self.fields = list()
+        for name, param in config.items():
+            method = param.get("method", "select")
+            if method != "select":
+                raise ValueError("Extractor only support select, got %s for %s" % (method, name))
+            params = param.get("params")
+            selector_ = CSSSelector(params["selector"]) if params else None
+            self.fields.append((name, selector_, param.get("nth", 0), param.get("attribute", "text")))
+
+    @staticmethod
+    def value(tag, attribute):
+        if tag is None:
+            return ""
+        if attribute == "text":
+            return tag.text_content().strip()
+        return tag.get(attribute, "").strip()
+
+    def extract(self, item):
+        values = dict()
+        for name, selector, nth, attribute in self.fields:
+            if selector is None:
+                tag = item
+            else:
+                tags = selector(item)
+                tag = tags[nth] if len(tags) > nth else None
+            values[name] = self.value(tag, attribute)
+        return values
+
+    def parse(self, document):
+        if not isinstance(document, Document):
+            document = Document(document, "utf-8")
+        if not document.body:
+            return
+        try:
+            root = html.document_fromstring(document.body, parser=parser_for(document.encoding))
+        except etree.ParserError:
+            return
+        for item in self.selector(root):
+            yield self.extract(item)
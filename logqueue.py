@@ -0,0 +1,140 @@
+# coding: utf-8
+
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler
+from Queue import Queue, Full
+from stats import stats
+
+SAMPLE = {"sample": True}
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        message = record.getMessage()
+        if isinstance(message, bytes):
+            message = message.decode("utf-8", "replace")
+        data = OrderedDict([
+            ("time", "%s.%03d" % (self.formatTime(record, "%Y-%m-%d %H:%M:%S"), record.msecs)),
+            ("level", record.levelname),
+            ("process", record.process),
+            ("thread", record.threadName),
+            ("message", message),
+        ])
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        elif record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data)
+
+
+class SampleFilter(logging.Filter):
+
+    def __init__(self, rate):
+        logging.Filter.__init__(self)
+        self.every = int(round(1 / rate)) if rate > 0 else 0
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        if not getattr(record, "sample", False):
+            return True
+        if not self.every:
+            return False
+        return next(self._counter) % self.every == 0
+
+
+class RotatingHandler(RotatingFileHandler):
+
+    def __init__(self, path, max_bytes=0, backups=0, interval=0):
+        RotatingFileHandler.__init__(self, path, maxBytes=max_bytes, backupCount=backups, delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at and time.time() >= self.rollover_at:
+            return True
+        return RotatingFileHandler.shouldRollover(self, record)
+
+    def doRollover(self):
+        RotatingFileHandler.doRollover(self)
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+
+class QueueHandler(logging.Handler):
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            record = self.prepare(record)
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record)
+            else:
+                self.queue.put_nowait(record)
+        except Full:
+            stats.count("log", "dropped")
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(object):
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        if self._thread:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+        for handler in self.handlers:
+            handler.close()
+
+
+def setup(path, level=logging.INFO, max_bytes=64 * 1024 * 1024, backups=10, interval=24 * 3600,
+          sample=0.01, queue_size=10000):
+    queue = Queue(maxsize=queue_size)
+    handler = RotatingHandler(path, max_bytes=max_bytes, backups=backups, interval=interval)
+    handler.setFormatter(JsonFormatter())
+    queue_handler = QueueHandler(queue)
+    queue_handler.addFilter(SampleFilter(sample))
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    listener = QueueListener(queue, handler)
+    listener.start()
+    return listener
@@ -1,147 +1,395 @@
 # coding:utf-8
 
-from bson import ObjectId
-from datetime import datetime, timedelta
-import requests
-from spiders import JokeNetEase, JokeNeiHan, JokeQiuShi, JokeXiHa, JokePengFu, JokeWaDuanZi
-from comments import CommentNetEase, CommentNeihan, CommentXiHa, CommentPengfu
-from pymongo import MongoClient
+from archive import Archive, NotArchived, RecordingClient, ReplayClient
+from engine import CrawlEngine
+from logqueue import SAMPLE, setup as setup_logging
+from shard import Lease, Shard
+from sites import Registry
+from stats import stats
+from transport import HttpClient, NotModified
+from datetime import datetime
+from multiprocessing import Process
+import argparse
 import logging
+import os
+import socket
+import time
 
 DEBUG = False
 UPLOAD_URL = "http://xxxx:8081/api/store/joke"
 UPLOAD_COMMENT_URL = "http://xxxx:8081/api/store/comment"
+WORKERS = 16
+SITE_LIMIT = 4
+HTTP_POOL_HOSTS = 10
+HTTP_POOL_SIZE = WORKERS
+HTTP_HOST_LIMIT = 8
+STORE_BATCH = 100
+STORE_MODE = "upsert"
+COMMENT_STORE_BATCH = 20
+UPLOAD_WORKERS = 4
+UPLOAD_RETRIES = 3
+DEDUP_PATH = "dedup.idx"
+MAX_PAGES = 10
+HTTP_CACHE_DIR = "http_cache"
+HTTP_CACHE_BYTES = 32 * 1024 * 1024
+HTTP_RATE = 2.0
+HTTP_MAX_RATE = 20.0
+HTTP_TARGET_LATENCY = 2.0
+HTTP_HOST_RATES = {"www.pengfu.com": 1.0, "www.waduanzi.com": 1.0}
+SEEN_RATIO = 0.8
+COMMENT_WORKERS = 8
+NEW_COMMENT_PRIORITY = 1000000
+REFRESH_HALF_LIFE = 2 * 24 * 3600
+STATS_JSON = "stats.json"
+STATS_PROM = "stats.prom"
+LEASE_TTL = 1800
+NEAR_DUP_SIMILARITY = 0.7
+NEAR_DUP_UPLOAD = False
+CHECKPOINT_PATH = "checkpoint.log"
+LOG_PATH = "joke.log"
+LOG_MAX_BYTES = 64 * 1024 * 1024
+LOG_BACKUPS = 10
+LOG_ROTATE_SECONDS = 24 * 3600
+LOG_SAMPLE = 0.01
+LOG_QUEUE = 10000
 
-SPIDER_MAP = [
-    # {"key": "neihan","url": "http://neihanshequ.com/joke/?is_json=1","class": JokeNeiHan,},
-    # {"key": "netease","url": "http://3g.163.com/touch/jsonp/joke/chanListNews/T1419316284722/2/0-40.html","class": JokeNetEase},
-    # {"key": "xixihaha","url": "http://www.xxhh.com/duanzi/","class": JokeXiHa},
-    # {"key": "qiushi","url": "http://m2.qiushibaike.com/article/list/text?page=1&count=30","class": JokeQiuShi},
-    {"key": "pengfu","url": "http://www.pengfu.com/xiaohua_1.html","class": JokePengFu},
-    {"key": "waduanzi","url": "http://www.waduanzi.com/joke/page/1","class": JokeWaDuanZi}
-]
-
-COMMENT_MAP = {
-    "xixihaha": CommentXiHa,
-    "netease": CommentNetEase,
-    "neihan": CommentNeihan,
-    "pengfu": CommentPengfu
-}
-
-if DEBUG:
-    client = MongoClient(
-        host="mongodb://user:password@公网IP:27017/thirdparty",
-        maxPoolSize=1, minPoolSize=1
-    )
-else:
-    client = MongoClient(
-        host="mongodb:///user:password@内网IP:27017/thirdparty",
-        maxPoolSize=1, minPoolSize=1
-    )
-db = client.get_default_database()
-joke_collection = db.jokes
-comment_collection = db.joke_comments
-
-
-def main():
-    for num,config in enumerate(SPIDER_MAP):
-        logging.info("task : %s" % num)
-        key = config.get("key")
-        logging.info("start crawl: %s" % key)
+registry = Registry()
+
+client = db = joke_collection = comment_collection = None
+comment_queue = near_duplicates = comment_scheduler = joke_writer = comment_writer = None
+http_client = upload_client = dedup = joke_uploader = comment_uploader = checkpoint = None
+
+
+def connect(suffix=""):
+    global client, db, joke_collection, comment_collection
+    global comment_queue, near_duplicates, comment_scheduler, joke_writer, comment_writer
+    global http_client, upload_client, dedup, joke_uploader, comment_uploader, checkpoint
+    from pymongo import MongoClient
+    from cache import HttpCache
+    from checkpoint import Checkpoint
+    from dedup import DedupIndex
+    from neardup import NearDuplicates
+    from ratelimit import RateLimiter
+    from scheduler import CommentScheduler
+    from storage import BatchWriter
+    from upload import Uploader
+    from workqueue import WorkQueue
+    if DEBUG:
+        client = MongoClient(
+            host="mongodb://user:password@公网IP:27017/thirdparty",
+            maxPoolSize=WORKERS, minPoolSize=1, connect=False
+        )
+    else:
+        client = MongoClient(
+            host="mongodb:///user:password@内网IP:27017/thirdparty",
+            maxPoolSize=WORKERS, minPoolSize=1, connect=False
+        )
+    db = client.get_default_database()
+    joke_collection = db.jokes
+    comment_collection = db.joke_comments
+    comment_queue = WorkQueue(db.comment_tasks)
+    near_duplicates = NearDuplicates(joke_collection, threshold=NEAR_DUP_SIMILARITY)
+    comment_scheduler = CommentScheduler(db.joke_stats, joke_collection, comment_queue, half_life=REFRESH_HALF_LIFE,
+                                         near_duplicates=NEAR_DUP_UPLOAD)
+    joke_writer = BatchWriter(joke_collection, batch_size=STORE_BATCH, counters=("n_comment", "n_like", "n_dislike"),
+                              match=("pb_site",))
+    comment_writer = BatchWriter(comment_collection, batch_size=COMMENT_STORE_BATCH)
+    http_client = HttpClient(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE,
+                             cache=HttpCache(HTTP_CACHE_DIR, max_bytes=HTTP_CACHE_BYTES),
+                             host_limit=HTTP_HOST_LIMIT,
+                             limiter=RateLimiter(rate=HTTP_RATE, max_rate=HTTP_MAX_RATE,
+                                                 target_latency=HTTP_TARGET_LATENCY, hosts=HTTP_HOST_RATES))
+    upload_client = HttpClient(pool_maxsize=UPLOAD_WORKERS)
+    dedup = DedupIndex(DEDUP_PATH.replace(".idx", "%s.idx" % suffix))
+    checkpoint = Checkpoint(CHECKPOINT_PATH.replace(".log", "%s.log" % suffix)).load()
+    joke_uploader = Uploader(upload_client, UPLOAD_URL, workers=UPLOAD_WORKERS,
+                             retries=UPLOAD_RETRIES, spool="upload_joke.spool", name="upload_joke",
+                             checkpoint=checkpoint)
+    comment_uploader = Uploader(upload_client, UPLOAD_COMMENT_URL, workers=UPLOAD_WORKERS,
+                                retries=UPLOAD_RETRIES, spool="upload_comment.spool", name="upload_comment",
+                                checkpoint=checkpoint)
+
+
+def main(stage="all", comment_workers=COMMENT_WORKERS, shard=None, backfill=False, keys=None,
+         record=None, replay=None):
+    global http_client
+    shard = shard or Shard()
+    suffix = ".%s" % shard.index if shard.total > 1 else ""
+    connect(suffix)
+    if replay:
+        http_client.close()
+        http_client = ReplayClient(Archive(replay))
+    elif record:
+        http_client = RecordingClient(http_client, Archive(record))
+    owner = "%s-%s" % (socket.gethostname(), os.getpid())
+    lease = Lease(db.leases, owner, ttl=LEASE_TTL)
+    engine = CrawlEngine(workers=WORKERS, site_limit=SITE_LIMIT)
+    if STORE_MODE == "upsert":
+        dedup.warm(comment_collection)
+    else:
+        dedup.warm(joke_collection, comment_collection)
+    comment_queue.ensure_indexes()
+    near_duplicates.ensure_indexes()
+    if backfill:
+        near_duplicates.backfill()
+    joke_uploader.start()
+    comment_uploader.start()
+    reconcile()
+    checkpoint.compact()
+    if stage in ("all", "jokes"):
+        engine.start()
+        for site in registry.enabled(keys):
+            if shard.owns(site.key):
+                engine.submit(site.key, crawl_source, engine, lease, site)
+        engine.join()
+    if stage in ("all", "comments"):
+        engine.limit("comment-worker", comment_workers)
+        engine.start()
+        buckets = shard.owned_buckets()
+        for num in range(comment_workers):
+            name = "%s-%s" % (owner, num)
+            engine.submit("comment-worker", comment_worker, name, buckets, shard.index == 0)
+        engine.join()
+        logging.info("comment tasks: %s" % comment_queue.counts())
+    joke_uploader.close()
+    comment_uploader.close()
+    dedup.save()
+    checkpoint.compact(drop=("site",))
+    checkpoint.close()
+    stats.log_summary()
+    stats.write_json(STATS_JSON.replace(".json", "%s.json" % suffix))
+    stats.write_prometheus(STATS_PROM.replace(".prom", "%s.prom" % suffix))
+    if http_client.limiter:
+        logging.info("http rates: %s" % http_client.limiter.rates())
+    http_client.close()
+    upload_client.close()
+    client.close()
+
+
+def crawl_source(engine, lease, site):
+    name = "source:%s" % site.key
+    if not lease.acquire(name):
+        return
+    try:
+        crawl_site(engine, site)
+    finally:
+        lease.release(name)
+
+
+def reconcile():
+    for page, data in checkpoint.pending("page", "fetched"):
+        recover(page, data)
+    pending = checkpoint.pending("joke", "stored")
+    if pending:
+        logging.info("reconcile %s stored jokes" % len(pending))
+    for joke_id, data in pending:
+        uploaded, _ = checkpoint.stage(joke_uploader.name, joke_id)
+        payload = None if uploaded else data["payload"]
+        process_joke(registry.get(data["site"]), joke_id, data["comment_need"], payload)
+
+
+def recover(page, data):
+    from spiders import Joke
+    site, since = registry.get(data["site"]), datetime.utcfromtimestamp(data["since"])
+    jokes = dict((unique, (pb_site, comment_need)) for unique, pb_site, comment_need in data["jokes"])
+    count = 0
+    for document in joke_collection.find({"unique": {"$in": list(jokes)}}):
+        pb_site, comment_need = jokes[document["unique"]]
+        joke_id = str(document["_id"])
+        if document.get("pb_site") != pb_site or document["insert"] < since or checkpoint.stage("joke", joke_id)[0]:
+            continue
+        if document.get("near_dup_of") is not None and not NEAR_DUP_UPLOAD:
+            continue
+        payload = Joke.from_document(document).to_upload_payload(document, site.online_source_id)
+        checkpoint.mark("joke", joke_id, "stored", {"site": site.key, "comment_need": comment_need, "payload": payload})
+        count += 1
+    if count:
+        logging.info("recover %s jokes stored from %s" % (count, page))
+    checkpoint.mark("page", page, "processed")
+
+
+def crawl_site(engine, site):
+    key = site.key
+    stage, progress = checkpoint.stage("site", key)
+    if stage == "done":
+        logging.info("skip crawl: %s finished in interrupted run" % key)
+        return
+    start = progress["page"] + 1 if stage == "page" else 1
+    logging.info("start crawl: %s from page %s" % (key, start))
+    spider = site.spider().with_client(http_client)
+    for page in range(start, (site.pages or MAX_PAGES) + 1):
+        url = spider.page_url(site.url, page)
+        if not url:
+            break
         try:
-            jokes = config["class"].run(config["url"])
+            jokes = list(spider.run(url, conditional=not (stage == "page" and page == start)))
+        except NotModified:
+            logging.info("%s page %s not modified" % (key, page))
+            break
+        except NotArchived:
+            logging.info("%s page %s not in archive" % (key, page))
+            break
         except Exception as e:
             logging.error(e.message, exc_info=True)
-        else:
-            for joke in jokes:
-                joke_id = joke.store(joke_collection)
-                if not joke_id:
-                    continue
-                else:
-                    upload_to_pg(str(joke_id))
-                if not COMMENT_MAP.get(key):
+            stats.count(key, "errors")
+            break
+        near = near_duplicates.flag(jokes)
+        if near:
+            stats.count(key, "near_duplicates", near)
+        if site.comments():
+            comment_scheduler.observe(key, jokes)
+        fetched = "%s:%s" % (key, page)
+        checkpoint.mark("page", fetched, "fetched", {
+            "site": key, "since": time.time() - 1,
+            "jokes": [[joke.digest(), joke.pb_site, joke.comment_need] for joke in jokes]})
+        if STORE_MODE == "upsert":
+            inserted, updated, unchanged = joke_writer.refresh(jokes)
+            for joke, document in updated:
+                if document.get("near_dup_of") is not None and not NEAR_DUP_UPLOAD:
                     continue
-                comments = COMMENT_MAP[key].run(joke_id, joke.comment_need)
-                for comment in comments:
-                    comment_id = comment.store(comment_collection)
-                    if comment_id:
-                        upload_comment_pg(str(comment_id))
-        logging.info("end crawl: %s" % key)
-    client.close()
+                upload_to_pg(site, joke, document)
+            logging.info("%s page %s: %s new, %s updated, %s unchanged"
+                         % (key, page, len(inserted), len(updated), len(unchanged)))
+            duplicates = unchanged + [document["unique"] for _, document in updated]
+        else:
+            inserted, duplicates = store(joke_writer, jokes)
+            logging.info("%s page %s: %s new, %s duplicate" % (key, page, len(inserted), len(duplicates)))
+        near = near_duplicates.recheck(inserted)
+        if near:
+            stats.count(key, "near_duplicates", near)
+        for joke, document in inserted:
+            if joke.near_dup_of is not None and not NEAR_DUP_UPLOAD:
+                logging.info("%s near duplicate of %s, skip upload" % (document["_id"], joke.near_dup_of),
+                             extra=SAMPLE)
+                continue
+            joke_id, payload = str(document["_id"]), joke.to_upload_payload(document, site.online_source_id)
+            checkpoint.mark("joke", joke_id, "stored",
+                            {"site": key, "comment_need": joke.comment_need, "payload": payload})
+            engine.submit(key, process_joke, site, joke_id, joke.comment_need, payload)
+        checkpoint.mark("page", fetched, "processed")
+        checkpoint.mark("site", key, "page", {"page": page})
+        http_client.commit([url])
+        if not jokes or len(duplicates) >= SEEN_RATIO * len(jokes):
+            break
+    checkpoint.mark("site", key, "done")
+    logging.info("end crawl: %s" % key)
 
 
-def upload_to_pg(_id):
-    try:
-        joke = joke_collection.find_one({"_id": ObjectId(_id)})
-    except Exception:
-        return
-    if not joke:
-        return
-    if joke["pb_site"] == u"捧腹网":
-        online_source_id = 5266
-    elif joke["pb_site"] == u"挖段子":
-        online_source_id = 5267
-    else:
-        return
-    assert isinstance(joke["pb_time"], datetime)
-    assert isinstance(joke["insert"], datetime)
-    insert = joke["insert"] + timedelta(hours=8)
-    data = {
-        "title": joke["content"],
-        "unique_id": _id,
-        "publish_site": joke["author"],
-        "publish_time": joke["pb_time"].isoformat()[:-7]+"Z",
-        "insert_time": insert.isoformat()[:-7]+"Z",
-        "author": joke["author"],
-        "author_icon": joke["avatar"],
-        "site_icon": joke["avatar"],
-        "source_id": online_source_id,
-        "online": True,
-        "content": [{"txt": joke["content"]}],
-        "like": joke["n_like"],
-        "dislike": joke["n_dislike"],
-        "comment": joke["n_comment"],
-    }
-    try:
-        r = requests.post(UPLOAD_URL, json=data, timeout=(3, 5))
-    except Exception as e:
-        logging.error(e.message)
-    else:
-        logging.info(r.content)
+def process_joke(site, joke_id, comment_need, payload):
+    joke_uploader.put(payload)
+    if site.comments():
+        comment_queue.put(joke_id, site.key, comment_need, NEW_COMMENT_PRIORITY)
+    checkpoint.mark("joke", joke_id, "processed")
+
+
+def comment_worker(name, buckets=None, legacy=True):
+    while True:
+        task = comment_queue.claim(name, buckets, legacy)
+        if not task:
+            return
+        try:
+            crawl_comments(task["key"], task["_id"], task["comment_need"])
+        except Exception as e:
+            logging.error(e.message, exc_info=True)
+            stats.count(task["key"], "comment_errors")
+            comment_queue.fail(task, e)
+        else:
+            comment_queue.done(task)
 
 
-def upload_comment_pg(_id):
+def crawl_comments(key, joke_id, comment_need):
+    fetched = list()
+    comments = registry.get(key).comments().with_client(http_client).run(joke_id, comment_need, fetched)
     try:
-        comment = comment_collection.find_one({"_id": ObjectId(_id)})
-    except Exception:
-        return
-    if not comment:
-        return
-    assert isinstance(comment["insert"], datetime)
-    insert = comment["insert"] + timedelta(hours=8)
-    data = {
-        "content": comment["content"],
-        "commend": comment["n_like"],
-        "insert_time": insert.isoformat()[:-7]+"Z",
-        "user_name": comment["author"],
-        "avatar": comment["avatar"],
-        "foreign_id": comment["joke"],
-        "unique_id": comment["unique"],
-    }
+        for inserted, duplicates in comment_writer.stream(unseen(comments)):
+            remember(inserted, duplicates)
+            for comment, document in inserted:
+                upload_comment_pg(comment, document)
+    finally:
+        comments.close()
+    http_client.commit(fetched)
+
+
+def unseen(records, seen=None):
+    for record in records:
+        unique = record.digest()
+        if dedup.seen(unique):
+            stats.count("dedup", "hits")
+            if seen is not None:
+                seen.append(unique)
+        else:
+            yield record
+
+
+def remember(inserted, duplicates):
+    for _, document in inserted:
+        dedup.add(document["unique"])
+    for unique in duplicates:
+        dedup.add(unique)
+
+
+def store(writer, records):
+    seen = list()
+    inserted, duplicates = writer.write(unseen(records, seen))
+    remember(inserted, duplicates)
+    return inserted, seen + duplicates
+
+
+def upload_to_pg(site, joke, document):
+    joke_uploader.put(joke.to_upload_payload(document, site.online_source_id))
+
+
+def upload_comment_pg(comment, document):
+    comment_uploader.put(comment.to_upload_payload(document))
+
+
+def run(log_path, *args, **kwargs):
+    listener = setup_logging(log_path, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS,
+                             interval=LOG_ROTATE_SECONDS, sample=LOG_SAMPLE, queue_size=LOG_QUEUE)
     try:
-        r = requests.post(UPLOAD_COMMENT_URL, json=data, timeout=(3, 5))
+        main(*args, **kwargs)
     except Exception as e:
-        logging.error(e.message)
-    else:
-        logging.info(r.content)
+        logging.error(e.message, exc_info=True)
+        raise
+    finally:
+        listener.stop()
 
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO,
-                        format="%(asctime)s %(levelname)s %(message)s",
-                        datefmt="%Y-%m-%d %H:%M:%S",
-                        filename="joke.log",
-                        filemode="a+")
-
-    main()
-    client.close()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("stage", nargs="?", default="all", choices=["all", "jokes", "comments"])
+    parser.add_argument("--comment-workers", type=int, default=COMMENT_WORKERS)
+    parser.add_argument("--shard", default="0/1", help="host index / host count, e.g. 1/3")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--backfill-near-dup", action="store_true")
+    parser.add_argument("--site", action="append", dest="sites", choices=[site.key for site in registry.sites],
+                        help="crawl only this site key, may repeat")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--record", metavar="ARCHIVE", help="save every downloaded response to this sqlite archive")
+    mode.add_argument("--replay", metavar="ARCHIVE", help="serve downloads from this archive, no network")
+    args = parser.parse_args()
+    try:
+        host, hosts = [int(value) for value in args.shard.split("/")]
+    except ValueError:
+        parser.error("--shard must be INDEX/COUNT, e.g. 1/3")
+    if hosts < 1:
+        parser.error("--shard host count must be at least 1")
+    if not 0 <= host < hosts:
+        parser.error("--shard index must be in 0..%s" % (hosts - 1))
+    if args.processes < 1:
+        parser.error("--processes must be at least 1")
+    total = hosts * args.processes
+    options = {"keys": args.sites, "record": args.record, "replay": args.replay}
+    if total == 1:
+        run(LOG_PATH, args.stage, args.comment_workers, backfill=args.backfill_near_dup, **options)
+    else:
+        processes = list()
+        for num in range(args.processes):
+            index = host * args.processes + num
+            processes.append(Process(target=run, kwargs=options, args=(
+                LOG_PATH.replace(".log", ".%s.log" % index), args.stage, args.comment_workers,
+                Shard(index, total), args.backfill_near_dup and num == 0)))
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
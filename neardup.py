@@ -0,0 +1,129 @@
+# coding: utf-8
+
+import hashlib
+import logging
+import random
+import re
+from types import UnicodeType
+from pymongo import UpdateOne
+
+SHINGLE = 3
+PRIME = (1 << 31) - 1
+BANDS = 16
+ROWS = 4
+IGNORED = re.compile(r"[\W_]+", re.UNICODE)
+
+_random = random.Random(20160601)
+PERMUTATIONS = [(_random.randint(1, PRIME - 1), _random.randint(0, PRIME - 1)) for _ in range(BANDS * ROWS)]
+
+
+def normalize(text):
+    if not text:
+        return u""
+    if not isinstance(text, UnicodeType):
+        text = text.decode("utf-8", "ignore")
+    return IGNORED.sub(u"", text.lower())
+
+
+def shingles(text, size=SHINGLE):
+    text = normalize(text)
+    if len(text) <= size:
+        return set([text]) if text else set()
+    return set(text[i:i + size] for i in range(len(text) - size + 1))
+
+
+def jaccard(a, b):
+    if not (a and b):
+        return 0.0
+    return float(len(a & b)) / len(a | b)
+
+
+def signature(features):
+    hashes = [int(hashlib.md5(feature.encode("utf-8")).hexdigest()[:8], 16) % PRIME for feature in features]
+    return [min((a * h + b) % PRIME for h in hashes) for a, b in PERMUTATIONS]
+
+
+def lsh_bands(text):
+    features = shingles(text)
+    if not features:
+        return []
+    rows = signature(features)
+    return [int(hashlib.md5("%s:%s" % (band, rows[band * ROWS:(band + 1) * ROWS])).hexdigest()[:15], 16)
+            for band in range(BANDS)]
+
+
+class NearDuplicates(object):
+
+    def __init__(self, collection, threshold=0.7):
+        self.collection = collection
+        self.threshold = threshold
+
+    def ensure_indexes(self):
+        self.collection.create_index("minhash_bands", sparse=True)
+
+    def _candidates(self, jokes):
+        keys = set()
+        for joke in jokes:
+            keys.update(joke.lsh_bands())
+        if not keys:
+            return list()
+        return [(candidate, shingles(candidate.get("content")))
+                for candidate in self.collection.find({"minhash_bands": {"$in": list(keys)}},
+                                                      {"content": 1, "unique": 1, "minhash_bands": 1,
+                                                       "near_dup_of": 1})]
+
+    def _match(self, joke, candidates, accept):
+        bands, features = set(joke.lsh_bands()), shingles(joke.content)
+        for candidate, candidate_features in candidates:
+            if not accept(candidate) or not bands.intersection(candidate["minhash_bands"]):
+                continue
+            if jaccard(features, candidate_features) >= self.threshold:
+                return candidate["_id"]
+
+    def flag(self, jokes):
+        candidates = self._candidates(jokes)
+        stored = dict((candidate.get("unique"), candidate) for candidate, _ in candidates)
+        flagged = 0
+        for joke in jokes:
+            if not joke.lsh_bands():
+                continue
+            unique = joke.digest()
+            if unique in stored:
+                joke.near_dup_of = stored[unique].get("near_dup_of")
+                continue
+            joke.near_dup_of = self._match(joke, candidates, lambda candidate: candidate.get("unique") != unique)
+            if joke.near_dup_of is not None:
+                flagged += 1
+        return flagged
+
+    def recheck(self, inserted):
+        fresh = [(joke, document) for joke, document in inserted if joke.near_dup_of is None and joke.lsh_bands()]
+        if not fresh:
+            return 0
+        candidates = self._candidates(joke for joke, _ in fresh)
+        operations = list()
+        for joke, document in fresh:
+            match = self._match(joke, candidates, lambda candidate: candidate["_id"] < document["_id"])
+            if match is not None:
+                joke.near_dup_of = document["near_dup_of"] = match
+                operations.append(UpdateOne({"_id": document["_id"]}, {"$set": {"near_dup_of": match}}))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    def backfill(self, batch_size=500):
+        operations, count = list(), 0
+        for document in self.collection.find({"minhash_bands": {"$exists": False}}, {"content": 1}):
+            bands = lsh_bands(document.get("content"))
+            if not bands:
+                continue
+            operations.append(UpdateOne({"_id": document["_id"]}, {"$set": {"minhash_bands": bands}}))
+            if len(operations) >= batch_size:
+                self.collection.bulk_write(operations, ordered=False)
+                count += len(operations)
+                operations = list()
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+            count += len(operations)
+        logging.info("near duplicate backfill %s: %s" % (self.collection.name, count))
+        return count
@@ -0,0 +1,97 @@
+# coding: utf-8
+
+import logging
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+from stats import stats
+
+THROTTLE_CODES = (429, 503)
+
+
+def retry_after(value, now=None):
+    if not value:
+        return 0
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return 0
+    return max(0, mktime_tz(parsed) - (now or time.time()))
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time()
+        self.blocked = 0
+
+    def reserve(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0, self.blocked - now)
+        if wait == 0 and self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return max(wait, (1 - self.tokens) / self.rate)
+
+
+class RateLimiter(object):
+
+    def __init__(self, rate=2.0, burst=4, min_rate=0.2, max_rate=20.0, target_latency=2.0,
+                 increase=0.1, decrease=0.5, hosts=None):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.target_latency = target_latency
+        self.increase = increase
+        self.decrease = decrease
+        self.hosts = hosts or dict()
+        self._lock = threading.Lock()
+        self._buckets = dict()
+
+    def bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.hosts.get(host, self.rate), self.burst)
+        return bucket
+
+    def acquire(self, host):
+        start = time.time()
+        while True:
+            with self._lock:
+                wait = self.bucket(host).reserve(time.time())
+            if not wait:
+                break
+            time.sleep(wait)
+        waited = time.time() - start
+        if waited:
+            stats.add_time(host, "throttle", waited)
+
+    def feedback(self, host, status, latency, retry=None):
+        with self._lock:
+            bucket = self.bucket(host)
+            rate = bucket.rate
+            if status is None or status in THROTTLE_CODES or status >= 500:
+                bucket.rate = max(self.min_rate, rate * self.decrease)
+                delay = retry_after(retry) if status in THROTTLE_CODES else 0
+                if delay:
+                    bucket.blocked = max(bucket.blocked, time.time() + delay)
+                    bucket.tokens = 0
+            elif latency > self.target_latency:
+                bucket.rate = max(self.min_rate, rate * (1 + self.decrease) / 2)
+            else:
+                bucket.rate = min(self.max_rate, rate + self.increase)
+        if bucket.rate < rate:
+            stats.count(host, "throttled")
+            logging.info("rate limit %s: %.2f -> %.2f req/s (status %s, %.2fs)"
+                         % (host, rate, bucket.rate, status, latency))
+
+    def rates(self):
+        with self._lock:
+            return dict((host, bucket.rate) for host, bucket in self._buckets.items())
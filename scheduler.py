@@ -0,0 +1,72 @@
+# coding: utf-8
+
+import logging
+from datetime import datetime
+from pymongo import UpdateOne
+
+
+class CommentScheduler(object):
+
+    def __init__(self, collection, jokes, queue, half_life=2 * 24 * 3600, min_growth=1,
+                 near_duplicates=False):
+        self.collection = collection
+        self.jokes = jokes
+        self.queue = queue
+        self.half_life = float(half_life)
+        self.min_growth = min_growth
+        self.near_duplicates = near_duplicates
+
+    def _seed(self, uniques):
+        stats = dict()
+        for joke in self.jokes.find({"unique": {"$in": uniques}}, {"unique": 1, "n_comment": 1, "insert": 1}):
+            stats[joke["unique"]] = {
+                "joke_id": joke["_id"],
+                "crawled_comment": joke.get("n_comment", 0),
+                "crawled": joke["insert"],
+                "first_seen": joke["insert"],
+            }
+        return stats
+
+    def priority(self, growth, stat, now):
+        hours = max((now - stat["crawled"]).total_seconds() / 3600.0, 1.0)
+        age = (now - stat["first_seen"]).total_seconds()
+        return growth / hours * 0.5 ** (age / self.half_life)
+
+    def observe(self, key, jokes):
+        jokes = dict((joke.digest(), joke) for joke in jokes
+                     if self.near_duplicates or joke.near_dup_of is None)
+        if not jokes:
+            return 0
+        uniques = list(jokes)
+        stats = dict((stat["_id"], stat) for stat in self.collection.find({"_id": {"$in": uniques}}))
+        missing = [unique for unique in uniques if unique not in stats]
+        seeded = self._seed(missing) if missing else dict()
+        now = datetime.utcnow()
+        operations, scheduled = list(), 0
+        for unique, joke in jokes.items():
+            stat = stats.get(unique) or seeded.get(unique)
+            if not stat:
+                continue
+            n_comment = joke.n_comment
+            update = {"key": key, "joke_id": stat["joke_id"], "comment_need": joke.comment_need,
+                      "n_comment": n_comment, "n_like": joke.n_like,
+                      "n_dislike": joke.n_dislike, "seen": now}
+            growth = n_comment - stat["crawled_comment"]
+            if growth >= self.min_growth:
+                self.queue.put(stat["joke_id"], key, joke.comment_need, self.priority(growth, stat, now))
+                update["crawled_comment"] = n_comment
+                update["crawled"] = now
+                scheduled += 1
+            elif unique in seeded:
+                update["crawled_comment"] = stat["crawled_comment"]
+                update["crawled"] = stat["crawled"]
+            operations.append(UpdateOne(
+                {"_id": unique},
+                {"$set": update, "$setOnInsert": {"first_seen": stat["first_seen"]}},
+                upsert=True
+            ))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        if scheduled:
+            logging.info("%s: schedule %s comment refresh" % (key, scheduled))
+        return scheduled
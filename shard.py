@@ -0,0 +1,71 @@
+# coding: utf-8
+
+import bisect
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+
+def hash_key(key):
+    if isinstance(key, unicode):
+        key = key.encode("utf-8")
+    return int(hashlib.md5(str(key)).hexdigest()[:16], 16)
+
+
+def bucket(key, buckets=1024):
+    return hash_key(key) % buckets
+
+
+class HashRing(object):
+
+    def __init__(self, nodes, replicas=100):
+        self.nodes = list(nodes)
+        self._ring = sorted((hash_key("%s#%s" % (node, i)), node)
+                            for node in self.nodes for i in range(replicas))
+        self._keys = [point for point, _ in self._ring]
+
+    def node(self, key):
+        index = bisect.bisect(self._keys, hash_key(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+class Shard(object):
+
+    def __init__(self, index=0, total=1, buckets=1024):
+        self.index = index
+        self.total = total
+        self.buckets = buckets
+        self.ring = HashRing(range(total))
+
+    def owns(self, key):
+        return self.total == 1 or self.ring.node(key) == self.index
+
+    def owned_buckets(self):
+        if self.total == 1:
+            return None
+        return [number for number in range(self.buckets) if self.ring.node("bucket-%s" % number) == self.index]
+
+
+class Lease(object):
+
+    def __init__(self, collection, owner, ttl=1800):
+        self.collection = collection
+        self.owner = owner
+        self.ttl = timedelta(seconds=ttl)
+
+    def acquire(self, name):
+        from pymongo.errors import DuplicateKeyError
+        now = datetime.utcnow()
+        try:
+            self.collection.update_one(
+                {"_id": name, "$or": [{"expires": {"$lt": now}}, {"owner": self.owner}]},
+                {"$set": {"owner": self.owner, "expires": now + self.ttl, "acquired": now}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            logging.info("lease %s held by another worker" % name)
+            return False
+        return True
+
+    def release(self, name):
+        self.collection.delete_one({"_id": name, "owner": self.owner})
@@ -0,0 +1,71 @@
+# coding: utf-8
+
+import importlib
+import json
+import os
+import threading
+
+SITES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sites.json")
+
+
+def load_class(path):
+    module, name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)
+
+
+class Site(object):
+
+    def __init__(self, key, url, spider, enabled=True, pb_site=None, online_source_id=None, pages=None,
+                 item=None, fields=None, comments=None, comment_url=None):
+        self.key = key
+        self.url = url
+        self.enabled = enabled
+        self.pb_site = pb_site
+        self.online_source_id = online_source_id
+        self.pages = pages
+        self.item = item
+        self.fields = fields
+        self.comment_url = comment_url
+        self._spider = spider
+        self._comments = comments
+        self._classes = dict()
+        self._lock = threading.Lock()
+
+    def _load(self, name, path, attributes):
+        with self._lock:
+            if name not in self._classes:
+                cls = load_class(path)
+                self._classes[name] = type(cls.__name__, (cls,), attributes())
+            return self._classes[name]
+
+    def _spider_attributes(self):
+        attributes = {"pb_site": self.pb_site}
+        if self.item:
+            from extract import Extractor
+            attributes["extractor"] = Extractor(self.item, self.fields or {})
+        return attributes
+
+    def spider(self):
+        return self._load("spider", self._spider, self._spider_attributes)
+
+    def comments(self):
+        if not self._comments:
+            return None
+        return self._load("comments", self._comments, lambda: {"COMMENT_URL": self.comment_url})
+
+
+class Registry(object):
+
+    def __init__(self, path=SITES_PATH):
+        self.path = path
+        with open(path) as f:
+            self.sites = [Site(**config) for config in json.load(f)]
+        self._keys = dict((site.key, site) for site in self.sites)
+
+    def get(self, key):
+        return self._keys[key]
+
+    def enabled(self, keys=None):
+        if keys:
+            return [self.get(key) for key in keys]
+        return [site for site in self.sites if site.enabled]
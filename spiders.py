@@ -1,90 +1,61 @@
 # coding: utf-8
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import hashlib
 import json
 import logging
 from types import UnicodeType
-import requests
-from w3lib.encoding import html_to_unicode
-from bs4 import Tag, BeautifulSoup
+from logqueue import SAMPLE
+from stats import stats
+from transport import NotModified, default_client
+from extract import charsets
+from neardup import lsh_bands
 from pymongo.errors import DuplicateKeyError
 
-
-
-def find_tag(root, param):
-    if not isinstance(root, (Tag, BeautifulSoup)):
-        return None
-    method = param.get("method", "find")
-    params = param["params"]
-    nth = param.get("nth", 0)
-    if method == "find":
-        tag = root.find(**params)
-        return tag
-    elif method == "find_all":
-        tags = root.find_all(**params)
-    elif method == "select":
-        tags = root.select(**params)
-    else:
-        raise ValueError("param['method'] only support find, find_all and select")
-    return tags[nth] if len(tags) > nth else None
-
-
-def find_tags(root, param):
-    if not isinstance(root, (Tag, BeautifulSoup)):
-        return []
-    method = param.get("method", "find_all")
-    params = param["params"]
-    if method == "find":
-        tag = root.find(**params)
-        if tag is None:
-            return []
-        else:
-            return [tag]
-    elif method == "find_all":
-        tags = root.find_all(**params)
-    elif method == "select":
-        tags = root.select(**params)
-    else:
-        raise ValueError("param['method'] only support find, find_all and select")
-    return tags
-
-
-def extract_tag_attribute(root, name="text"):
-    if root is None:
-        return ""
-    assert isinstance(root, (Tag, BeautifulSoup))
-    if name == "text":
-        return root.get_text().strip()
-    else:
-        value = root.get(name, "")
-        if isinstance(value, (list, tuple)):
-            return ",".join(value)
-        else:
-            return value.strip()
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
 
 class JokeBase(object):
     headers = {"user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.86 Safari/537.36"}
     timeout = 30
+    client = None
     r_json = False
+    pb_site = None
+    extractor = None
 
     @classmethod
-    def download(cls, url, c_json=False, skip=None, headers=None):
+    def with_client(cls, client):
+        return type(cls.__name__, (cls,), {"client": client})
+
+    @classmethod
+    def download(cls, url, c_json=False, skip=None, headers=None, conditional=False):
         if headers is None:
             headers = cls.headers
-        response = requests.get(url, headers=headers, timeout=(10, cls.timeout))
+        client = cls.client or default_client()
+        try:
+            with stats.timer(cls.__name__, "download"):
+                response = client.get(url, conditional=conditional, headers=headers, timeout=(10, cls.timeout))
+        except Exception:
+            stats.count(cls.__name__, "errors")
+            raise
+        if response.status_code == 304:
+            stats.count(cls.__name__, "not_modified")
+            raise NotModified(url)
         content = response.content
+        stats.count(cls.__name__, "bytes", len(content))
         if skip:
             content = content[skip[0]:skip[1]]
-        if c_json:
-            return json.loads(content)
-        else:
-            _, content = html_to_unicode(
-                content_type_header=response.headers.get("content-type"),
-                html_body_str=content
-            )
-            return content.encode("utf-8")
+        with stats.timer(cls.__name__, "decode"):
+            if c_json:
+                return json.loads(content)
+            else:
+                return charsets.document(url, response.headers.get("content-type"), content)
+
+    @classmethod
+    def page_url(cls, url, page):
+        if "{page}" in url:
+            return url.format(page=page)
+        return url if page == 1 else None
 
     @classmethod
     def prepare(cls, document):
@@ -95,27 +66,50 @@ class JokeBase(object):
         raise NotImplementedError
 
     @classmethod
-    def run(cls, url):
-        document = cls.download(url, c_json=cls.r_json)
+    def run(cls, url, conditional=True):
+        document = cls.download(url, c_json=cls.r_json, conditional=conditional)
         doc = cls.prepare(document)
-        jokes = cls.parse(doc)
-        logging.info("%s: %s" % (cls.__name__, len(jokes)))
-        return jokes
+        count = 0
+        for joke in stats.timed_iter(cls.__name__, "parse", cls.parse(doc)):
+            count += 1
+            yield joke
+        logging.info("%s: %s" % (cls.__name__, count))
 
 
 class Joke(object):
 
-    def __init__(self):
-        self.title = None
-        self.author = None
-        self.avatar = None
-        self.pb_time = datetime.utcnow()
-        self.pb_site = None
-        self.content = None
-        self.n_comment = 0
-        self.n_like = 0
-        self.n_dislike = 0
-        self.comment_need = {}
+    __slots__ = ("title", "author", "avatar", "pb_time", "pb_site", "content",
+                 "n_comment", "n_like", "n_dislike", "code", "near_dup_of", "_bands")
+
+    def __init__(self, title=None, author=None, avatar=None, pb_time=None, pb_site=None, content=None,
+                 n_comment=0, n_like=0, n_dislike=0, code=None):
+        self.title = title
+        self.author = author
+        self.avatar = avatar
+        self.pb_time = pb_time or datetime.utcnow()
+        self.pb_site = pb_site
+        self.content = content
+        self.n_comment = n_comment
+        self.n_like = n_like
+        self.n_dislike = n_dislike
+        self.code = code
+        self.near_dup_of = None
+        self._bands = None
+
+    @classmethod
+    def from_document(cls, document):
+        joke = cls(title=document.get("title"), author=document.get("author"), avatar=document.get("avatar"),
+                   pb_time=document.get("pb_time"), pb_site=document.get("pb_site"),
+                   content=document.get("content"), n_comment=document.get("n_comment", 0),
+                   n_like=document.get("n_like", 0), n_dislike=document.get("n_dislike", 0))
+        joke.near_dup_of = document.get("near_dup_of")
+        return joke
+
+    @property
+    def comment_need(self):
+        if self.code is None:
+            return {}
+        return {"code": self.code, "comment_count": self.n_comment}
 
     def show(self):
         print("title: %s" % self.title)
@@ -135,23 +129,61 @@ class Joke(object):
             string = string.encode("utf-8")
         return hashlib.md5(string).hexdigest()
 
-    def store(self, collection):
+    def digest(self):
+        return self.unique(self.content)
+
+    def lsh_bands(self):
+        if self._bands is None:
+            self._bands = lsh_bands(self.content)
+        return self._bands
+
+    def to_document(self):
         if not (self.author or self.avatar or self.content):
             logging.warn("joke miss fields author: %s, avatar: %s content: %s"
                          % (self.author, self.avatar, self.content))
-        document = dict()
+        document = {
+            "author": self.author,
+            "avatar": self.avatar,
+            "pb_time": self.pb_time,
+            "pb_site": self.pb_site,
+            "content": self.content,
+            "n_comment": self.n_comment,
+            "n_like": self.n_like,
+            "n_dislike": self.n_dislike,
+            "insert": datetime.utcnow(),
+            "unique": self.digest(),
+        }
         if self.title:
             document["title"] = self.title
-        document["author"] = self.author
-        document["avatar"] = self.avatar
-        document["pb_time"] = self.pb_time
-        document["pb_site"] = self.pb_site
-        document["content"] = self.content
-        document["n_comment"] = int(self.n_comment)
-        document["n_like"] = int(self.n_like)
-        document["n_dislike"] = int(self.n_dislike)
-        document["insert"] = datetime.utcnow()
-        document["unique"] = self.unique(document["content"])
+        if self.near_dup_of is not None:
+            document["near_dup_of"] = self.near_dup_of
+        bands = self.lsh_bands()
+        if bands:
+            document["minhash_bands"] = bands
+        return document
+
+    def to_upload_payload(self, document, source_id):
+        if source_id is None:
+            return
+        return {
+            "title": self.content,
+            "unique_id": str(document["_id"]),
+            "publish_site": self.author,
+            "publish_time": document["pb_time"].strftime(TIME_FORMAT),
+            "insert_time": (document["insert"] + timedelta(hours=8)).strftime(TIME_FORMAT),
+            "author": self.author,
+            "author_icon": self.avatar,
+            "site_icon": self.avatar,
+            "source_id": source_id,
+            "online": True,
+            "content": [{"txt": self.content}],
+            "like": self.n_like,
+            "dislike": self.n_dislike,
+            "comment": self.n_comment,
+        }
+
+    def store(self, collection):
+        document = self.to_document()
         try:
             result = collection.insert_one(document)
         except DuplicateKeyError:
@@ -159,13 +191,10 @@ class Joke(object):
         except Exception as e:
             logging.error(e.message, exc_info=True)
         else:
-            logging.info("store joke id: %s" % result.inserted_id)
+            logging.info("store joke id: %s" % result.inserted_id, extra=SAMPLE)
             return result.inserted_id
 
 
-
-
-
 class JokeNeiHan(JokeBase):
 
     r_json = True
@@ -174,43 +203,46 @@ class JokeNeiHan(JokeBase):
     def parse(cls, document):
         data = document.get("data", {})
         groups = data.get("data", [])
-        jokes = list()
         for g in groups:
             g = g["group"]
-            joke = Joke()
-            joke.author = g["user"]["name"]
-            joke.avatar = g["user"]["avatar_url"]
-            joke.pb_time = datetime.fromtimestamp(g["create_time"])
-            joke.pb_site = u"内涵段子"
-            joke.content = g["text"]
-            joke.n_comment = g["comment_count"]
-            joke.n_like = g["digg_count"]
-            joke.n_dislike = g["bury_count"]
-            joke.comment_need["code"] = g["code"]
-            jokes.append(joke)
-        return jokes
+            yield Joke(
+                author=g["user"]["name"],
+                avatar=g["user"]["avatar_url"],
+                pb_time=datetime.fromtimestamp(g["create_time"]),
+                pb_site=cls.pb_site,
+                content=g["text"],
+                n_comment=int(g["comment_count"]),
+                n_like=int(g["digg_count"]),
+                n_dislike=int(g["bury_count"]),
+                code=g["code"],
+            )
 
 
 class JokeNetEase(JokeBase):
 
     r_json = True
+    LIMIT = 40
+
+    @classmethod
+    def page_url(cls, url, page):
+        if "{offset}" in url:
+            return url.format(offset=(page - 1) * cls.LIMIT, limit=cls.LIMIT)
+        return super(JokeNetEase, cls).page_url(url, page)
 
     @classmethod
     def parse(cls, document):
         data = document.get(u"段子", [])
-        jokes = list()
         for g in data:
             if g.get("imgsum", 0) == 0:
-                joke = Joke()
-                joke.title = g["title"]
-                joke.pb_site = g["source"]
-                joke.content = g["digest"]
-                joke.n_comment = g["replyCount"]
-                joke.n_like = g["upTimes"]
-                joke.n_dislike = g["downTimes"]
-                joke.comment_need["code"] = g["docid"]
-                jokes.append(joke)
-        return jokes
+                yield Joke(
+                    title=g["title"],
+                    pb_site=g["source"],
+                    content=g["digest"],
+                    n_comment=int(g["replyCount"]),
+                    n_like=int(g["upTimes"]),
+                    n_dislike=int(g["downTimes"]),
+                    code=g["docid"],
+                )
 
 
 class JokeQiuShi(JokeBase):
@@ -226,46 +258,30 @@ class JokeQiuShi(JokeBase):
 
     @classmethod
     def parse(cls, document):
-        jokes = list()
         data = document.get("items", [])
         for g in data:
             if not g.get("user"):
                 continue
-            joke = Joke()
-            joke.author = g["user"]["login"]
             avatar = g["user"].get("thumb")
             if not avatar:
                 continue
             if avatar.startswith("//"):
                 avatar = "http:" + avatar
-            joke.avatar = avatar
-            joke.pb_site = u"糗事百科"
-            joke.pb_time = datetime.fromtimestamp(g["created_at"])
-            joke.content = g["content"]
-            joke.n_comment = g.get("comments_count", 0)
-            if g.get("votes"):
-                joke.n_like = g["votes"]["up"]
-                joke.n_dislike = abs(g["votes"]["down"])
-            jokes.append(joke)
-        return jokes
+            votes = g.get("votes") or {"up": 0, "down": 0}
+            yield Joke(
+                author=g["user"]["login"],
+                avatar=avatar,
+                pb_site=cls.pb_site,
+                pb_time=datetime.fromtimestamp(g["created_at"]),
+                content=g["content"],
+                n_comment=int(g.get("comments_count", 0)),
+                n_like=int(votes["up"]),
+                n_dislike=abs(int(votes["down"])),
+            )
 
 
 class JokeXiHa(JokeBase):
 
-    config = {
-        "id": {"params": {"selector": "div.comment"}, "method": "select", "attribute": "id"},
-        "content": {"params": {"selector": "div.article > pre"}, "method": "select"},
-        "author": {"params": {"selector": "div.user-info-username > a"}, "method": "select"},
-        "avatar": {"params": {"selector": "div.user-avatar40 > a > img"}, "attribute": "src", "method": "select"},
-    }
-
-    @staticmethod
-    def find_extract_tag_attribute(tag, params):
-        if params.get("params"):
-            tag = find_tag(tag, params)
-        attribute = params.get("attribute", "text")
-        return extract_tag_attribute(tag, attribute)
-
     @classmethod
     def fetch_metadata(cls, ids):
         url = "http://dg.xxhh.com/getcnums/?__jsonp__=fn&ids={ids}".format(ids=",".join(ids))
@@ -281,104 +297,51 @@ class JokeXiHa(JokeBase):
 
     @classmethod
     def parse(cls, document):
-        soup = BeautifulSoup(document, "lxml", from_encoding="utf-8")
-        tags = soup.select(selector="div.min > div.section")
         jokes = list()
-        for tag in tags:
-            joke = Joke()
-            joke.author = cls.find_extract_tag_attribute(tag, cls.config["author"])
-            joke.avatar = cls.find_extract_tag_attribute(tag, cls.config["avatar"])
-            joke.pb_site = u"嘻嘻哈哈"
-            joke.content = cls.find_extract_tag_attribute(tag, cls.config["content"])
-            _id = cls.find_extract_tag_attribute(tag, cls.config["id"])
-            joke.id = _id.replace("comment-", "")
-            jokes.append(joke)
-        metadata = cls.fetch_metadata([joke.id for joke in jokes])
+        for item in cls.extractor.parse(document):
+            jokes.append(Joke(
+                author=item["author"],
+                avatar=item["avatar"],
+                pb_site=cls.pb_site,
+                content=item["content"],
+                code=item["id"].replace("comment-", ""),
+            ))
+        metadata = cls.fetch_metadata([joke.code for joke in jokes])
         for joke in jokes:
-            meta = metadata[joke.id]
+            meta = metadata[joke.code]
             joke.n_comment = meta["n_comment"]
             joke.n_like = meta["n_like"]
             joke.n_dislike = meta["n_dislike"]
-            joke.comment_need["code"] = joke.id
-            del joke.id
-        return jokes
+            yield joke
 
 class JokePengFu(JokeBase):
 
-    config = {
-        "id": { "method": "select", "attribute": "id"},
-        "title": {"params": {"selector": "h1.dp-b > a"}, "method": "select"},
-        "content": {"params": {"selector": "div.content-img"}, "method": "select"},
-        "author": {"params": {"selector": "p.user_name_list > a"}, "method": "select"},
-        "avatar": {"params": {"selector": "a.mem-header > img"}, "attribute": "src", "method": "select"},
-        "n_like": {"params": {"selector": "span.ding em"}, "method": "select"},
-        "n_dislike": {"params": {"selector": "span.cai em"}, "method": "select"},
-        "n_comment": {"params": {"selector": "span.commentClick em"}, "method": "select"},
-
-    }
-
-    @staticmethod
-    def find_extract_tag_attribute(tag, params):
-        if params.get("params"):
-            tag = find_tag(tag, params)
-        attribute = params.get("attribute", "text")
-        return extract_tag_attribute(tag, attribute)
-
-
     @classmethod
     def parse(cls, document):
-        soup = BeautifulSoup(document, "lxml", from_encoding="utf-8")
-        tags = soup.select(selector="div.list-item")
-        jokes = list()
-        for tag in tags:
-            joke = Joke()
-            joke.title = cls.find_extract_tag_attribute(tag,cls.config["title"])
-            joke.author = cls.find_extract_tag_attribute(tag, cls.config["author"])
-            joke.avatar = cls.find_extract_tag_attribute(tag, cls.config["avatar"])
-            joke.pb_site = u"捧腹网"
-            joke.content = cls.find_extract_tag_attribute(tag, cls.config["content"])
-            joke.n_comment = cls.find_extract_tag_attribute(tag,cls.config["n_comment"])
-            joke.n_like = cls.find_extract_tag_attribute(tag,cls.config["n_like"])
-            joke.n_dislike = cls.find_extract_tag_attribute(tag,cls.config["n_dislike"])
-            joke.comment_need["code"] = cls.find_extract_tag_attribute(tag,cls.config["id"])
-            jokes.append(joke)
-        return jokes
+        for item in cls.extractor.parse(document):
+            yield Joke(
+                title=item["title"],
+                author=item["author"],
+                avatar=item["avatar"],
+                pb_site=cls.pb_site,
+                content=item["content"],
+                n_comment=int(item["n_comment"]),
+                n_like=int(item["n_like"]),
+                n_dislike=int(item["n_dislike"]),
+                code=item["id"],
+            )
 
 class JokeWaDuanZi(JokeBase):
 
-    config = {
-        "title": {"params": {"selector": "h2.item-title > a"}, "method": "select"},
-        "content": {"params": {"selector": "div.item-content"}, "method": "select"},
-        "author": {"params": {"selector": "div.post-author > a"}, "method": "select"},
-        "avatar": {"params": {"selector": "div.post-author > img"}, "attribute": "src", "method": "select"},
-        "n_like": {"params": {"selector": "div.item-toolbar > ul > li:nth-of-type(1) > a"}, "method": "select"},
-        "n_dislike": {"params": {"selector": "div.item-toolbar > ul > li:nth-of-type(2) > a"}, "method": "select"},
-
-    }
-
-    @staticmethod
-    def find_extract_tag_attribute(tag, params):
-        if params.get("params"):
-            tag = find_tag(tag, params)
-        attribute = params.get("attribute", "text")
-        return extract_tag_attribute(tag, attribute)
-
-
     @classmethod
     def parse(cls, document):
-        soup = BeautifulSoup(document, "lxml", from_encoding="utf-8")
-        tags = soup.select(selector="div.post-item")
-        jokes = list()
-        for tag in tags:
-            joke = Joke()
-            joke.title = cls.find_extract_tag_attribute(tag,cls.config["title"])
-            joke.author = cls.find_extract_tag_attribute(tag, cls.config["author"])
-            joke.avatar = cls.find_extract_tag_attribute(tag, cls.config["avatar"])
-            joke.pb_site = u"挖段子"
-            joke.content = cls.find_extract_tag_attribute(tag, cls.config["content"])
-            joke.n_comment = 0
-            joke.n_like = cls.find_extract_tag_attribute(tag,cls.config["n_like"])
-            n_dislike = cls.find_extract_tag_attribute(tag,cls.config["n_dislike"])
-            joke.n_dislike = abs(int(n_dislike))
-            jokes.append(joke)
-        return jokes
+        for item in cls.extractor.parse(document):
+            yield Joke(
+                title=item["title"],
+                author=item["author"],
+                avatar=item["avatar"],
+                pb_site=cls.pb_site,
+                content=item["content"],
+                n_like=int(item["n_like"]),
+                n_dislike=abs(int(item["n_dislike"])),
+            )
@@ -0,0 +1,110 @@
+# coding: utf-8
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._timings = defaultdict(lambda: [0, 0.0, 0.0])
+        self._counters = defaultdict(int)
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._timings.clear()
+            self._counters.clear()
+
+    def add_time(self, name, stage, seconds):
+        with self._lock:
+            timing = self._timings[(name, stage)]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def count(self, name, metric, value=1):
+        with self._lock:
+            self._counters[(name, metric)] += value
+
+    @contextmanager
+    def timer(self, name, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, stage, time.time() - start)
+
+    def timed_iter(self, name, stage, iterable):
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, stage, time.time() - start)
+                return
+            self.add_time(name, stage, time.time() - start)
+            self.count(name, "items")
+            yield item
+
+    def summary(self):
+        with self._lock:
+            timings, counters = dict(self._timings), dict(self._counters)
+        result = {"started": self.started, "elapsed": time.time() - self.started,
+                  "timings": dict(), "counters": dict()}
+        for (name, stage), (calls, total, longest) in timings.items():
+            result["timings"].setdefault(name, dict())[stage] = {
+                "calls": calls, "seconds": total, "max": longest}
+        for (name, metric), value in counters.items():
+            result["counters"].setdefault(name, dict())[metric] = value
+        return result
+
+    def log_summary(self):
+        summary = self.summary()
+        logging.info("run summary: %.1fs" % summary["elapsed"])
+        for name in sorted(set(summary["timings"]) | set(summary["counters"])):
+            stages = ", ".join("%s %.3fs/%s" % (stage, value["seconds"], value["calls"])
+                               for stage, value in sorted(summary["timings"].get(name, {}).items()))
+            counters = ", ".join("%s %s" % item for item in sorted(summary["counters"].get(name, {}).items()))
+            logging.info("%s: %s | %s" % (name, stages, counters))
+
+    @staticmethod
+    def _dump(path, data):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.rename(tmp, path)
+
+    def write_json(self, path):
+        self._dump(path, json.dumps(self.summary(), indent=2, sort_keys=True))
+
+    def write_prometheus(self, path, prefix="joke_spider"):
+        summary = self.summary()
+        lines = [
+            "# TYPE %s_stage_seconds_total counter" % prefix,
+            "# TYPE %s_stage_calls_total counter" % prefix,
+            "# TYPE %s_stage_seconds_max gauge" % prefix,
+            "# TYPE %s_events_total counter" % prefix,
+        ]
+        for name, stages in sorted(summary["timings"].items()):
+            for stage, value in sorted(stages.items()):
+                labels = '{name="%s",stage="%s"}' % (name, stage)
+                lines.append("%s_stage_seconds_total%s %f" % (prefix, labels, value["seconds"]))
+                lines.append("%s_stage_calls_total%s %d" % (prefix, labels, value["calls"]))
+                lines.append("%s_stage_seconds_max%s %f" % (prefix, labels, value["max"]))
+        for name, counters in sorted(summary["counters"].items()):
+            for metric, value in sorted(counters.items()):
+                lines.append('%s_events_total{name="%s",metric="%s"} %d' % (prefix, name, metric, value))
+        lines.append("%s_run_seconds %f" % (prefix, summary["elapsed"]))
+        self._dump(path, "\n".join(lines) + "\n")
+
+
+stats = Stats()
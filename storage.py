@@ -0,0 +1,131 @@
+# coding: utf-8
+
+import logging
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from logqueue import SAMPLE
+from stats import stats
+
+DUPLICATE_KEY = 11000
+
+
+class BatchWriter(object):
+
+    def __init__(self, collection, batch_size=100, counters=(), match=()):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.counters = counters
+        self.match = match
+
+    def stream(self, records):
+        batch = list()
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                yield self._insert(batch)
+                batch = list()
+        if batch:
+            yield self._insert(batch)
+
+    def write(self, records):
+        inserted, duplicates = list(), list()
+        for inserted_, duplicates_ in self.stream(records):
+            inserted.extend(inserted_)
+            duplicates.extend(duplicates_)
+        return inserted, duplicates
+
+    def _insert(self, records):
+        if not records:
+            return list(), list()
+        documents = [record.to_document() for record in records]
+        errors = dict()
+        name = self.collection.name
+        try:
+            with stats.timer(name, "store"):
+                self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                errors[error["index"]] = error
+                if error.get("code") != DUPLICATE_KEY:
+                    logging.error("store %s failed: %s" % (self.collection.name, error.get("errmsg")))
+        except Exception as e:
+            logging.error("store %s failed: %s" % (name, e))
+            stats.count(name, "errors", len(records))
+            raise
+        inserted, duplicates = list(), list()
+        for index, (record, document) in enumerate(zip(records, documents)):
+            error = errors.get(index)
+            if error is None:
+                logging.info("store %s id: %s" % (self.collection.name, document["_id"]), extra=SAMPLE)
+                inserted.append((record, document))
+            elif error.get("code") == DUPLICATE_KEY:
+                duplicates.append(document["unique"])
+        stats.count(name, "inserted", len(inserted))
+        stats.count(name, "duplicates", len(duplicates))
+        stats.count(name, "errors", len(records) - len(inserted) - len(duplicates))
+        return inserted, duplicates
+
+    def refresh(self, records):
+        inserted, updated, unchanged = list(), list(), list()
+        records = list(records)
+        for start in range(0, len(records), self.batch_size):
+            inserted_, updated_, unchanged_ = self._upsert(records[start:start + self.batch_size])
+            inserted.extend(inserted_)
+            updated.extend(updated_)
+            unchanged.extend(unchanged_)
+        return inserted, updated, unchanged
+
+    def _upsert(self, records):
+        if not records:
+            return list(), list(), list()
+        documents = [record.to_document() for record in records]
+        operations = list()
+        for document in documents:
+            counters = dict((name, document[name]) for name in self.counters)
+            spec = dict((name, document.get(name)) for name in self.match)
+            spec["unique"] = document["unique"]
+            spec["$or"] = [{name: {"$ne": value}} for name, value in counters.items()]
+            fixed = dict((name, value) for name, value in document.items()
+                         if name not in counters and name not in spec)
+            operations.append(UpdateOne(
+                spec,
+                {"$set": counters, "$setOnInsert": fixed},
+                upsert=True
+            ))
+        errors, upserted = dict(), dict()
+        name = self.collection.name
+        try:
+            with stats.timer(name, "store"):
+                result = self.collection.bulk_write(operations, ordered=False)
+            upserted = result.upserted_ids
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                errors[error["index"]] = error
+                if error.get("code") != DUPLICATE_KEY:
+                    logging.error("refresh %s failed: %s" % (self.collection.name, error.get("errmsg")))
+            upserted = dict((item["index"], item["_id"]) for item in e.details.get("upserted", []))
+        except Exception as e:
+            logging.error("refresh %s failed: %s" % (name, e))
+            stats.count(name, "errors", len(records))
+            raise
+        inserted, changed, unchanged = list(), dict(), list()
+        for index, (record, document) in enumerate(zip(records, documents)):
+            error = errors.get(index)
+            if index in upserted:
+                document["_id"] = upserted[index]
+                logging.info("store %s id: %s" % (self.collection.name, document["_id"]), extra=SAMPLE)
+                inserted.append((record, document))
+            elif error is None:
+                changed[document["unique"]] = record
+            elif error.get("code") == DUPLICATE_KEY:
+                unchanged.append(document["unique"])
+        updated = list()
+        if changed:
+            with stats.timer(name, "reload"):
+                for document in self.collection.find({"unique": {"$in": list(changed)}}):
+                    updated.append((changed[document["unique"]], document))
+        stats.count(name, "inserted", len(inserted))
+        stats.count(name, "updated", len(changed))
+        stats.count(name, "duplicates", len(unchanged))
+        stats.count(name, "errors", len(records) - len(inserted) - len(changed) - len(unchanged))
+        return inserted, updated, unchanged
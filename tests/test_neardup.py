@@ -0,0 +1,67 @@
+# coding: utf-8
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from neardup import NearDuplicates
+from spiders import Joke
+from storage import BatchWriter
+
+TEXT = u"从前有座山，山里有座庙，庙里有个老和尚在给小和尚讲故事，讲的是什么呢？"
+AD = u"关注公众号看更多"
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class NearDuplicatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient().thirdparty.jokes
+        self.collection.create_index("unique", unique=True)
+        self.writer = BatchWriter(self.collection, counters=("n_comment", "n_like", "n_dislike"), match=("pb_site",))
+        self.near = NearDuplicates(self.collection)
+
+    def crawl(self, jokes):
+        self.near.flag(jokes)
+        inserted, _, _ = self.writer.refresh(jokes)
+        self.near.recheck(inserted)
+        return inserted
+
+    def test_flags_copy_of_stored_joke(self):
+        original = self.crawl([Joke(pb_site="pengfu", content=TEXT)])[0][1]
+        copy = Joke(pb_site="waduanzi", content=TEXT + AD)
+        self.crawl([copy])
+        self.assertEqual(copy.near_dup_of, original["_id"])
+
+    def test_flags_copies_on_the_same_page(self):
+        inserted = self.crawl([Joke(pb_site="pengfu", content=TEXT), Joke(pb_site="pengfu", content=TEXT + AD)])
+        self.assertEqual([joke.near_dup_of for joke, _ in inserted], [None, inserted[0][1]["_id"]])
+        self.assertEqual(self.collection.count_documents({"near_dup_of": inserted[0][1]["_id"]}), 1)
+
+    def test_flags_one_of_two_concurrent_copies(self):
+        original, copy = Joke(pb_site="pengfu", content=TEXT), Joke(pb_site="waduanzi", content=TEXT + AD)
+        self.near.flag([original])
+        self.near.flag([copy])
+        stored, _, _ = self.writer.refresh([original])
+        copied, _, _ = self.writer.refresh([copy])
+        self.near.recheck(copied)
+        self.near.recheck(stored)
+        self.assertIsNone(original.near_dup_of)
+        self.assertEqual(copy.near_dup_of, stored[0][1]["_id"])
+
+    def test_keeps_stored_flag_when_crawled_again(self):
+        inserted = self.crawl([Joke(pb_site="pengfu", content=TEXT), Joke(pb_site="pengfu", content=TEXT + AD)])
+        again = [Joke(pb_site="pengfu", content=TEXT), Joke(pb_site="pengfu", content=TEXT + AD)]
+        self.assertEqual(self.near.flag(again), 0)
+        self.assertEqual([joke.near_dup_of for joke in again], [None, inserted[0][1]["_id"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+# coding: utf-8
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+from spiders import Joke
+from storage import BatchWriter
+
+COUNTERS = ("n_comment", "n_like", "n_dislike")
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class RefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient().thirdparty.jokes
+        self.collection.create_index("unique", unique=True)
+        self.writer = BatchWriter(self.collection, counters=COUNTERS, match=("pb_site",))
+
+    def jokes(self, pb_site, n_like=1):
+        return [Joke(pb_site=pb_site, content=u"joke %s" % i, n_comment=1, n_like=n_like, n_dislike=0)
+                for i in range(3)]
+
+    def refresh(self, jokes):
+        inserted, updated, unchanged = self.writer.refresh(jokes)
+        return len(inserted), len(updated), len(unchanged)
+
+    def test_unchanged_page(self):
+        self.assertEqual(self.refresh(self.jokes("pengfu")), (3, 0, 0))
+        self.assertEqual(self.refresh(self.jokes("pengfu")), (0, 0, 3))
+
+    def test_changed_counters(self):
+        self.refresh(self.jokes("pengfu"))
+        inserted, updated, unchanged = self.writer.refresh(self.jokes("pengfu", n_like=5))
+        self.assertEqual((len(inserted), len(updated), len(unchanged)), (0, 3, 0))
+        self.assertEqual(set(document["n_like"] for _, document in updated), set([5]))
+
+    def test_same_content_on_two_sites(self):
+        self.assertEqual(self.refresh(self.jokes("pengfu")), (3, 0, 0))
+        self.assertEqual(self.refresh(self.jokes("waduanzi", n_like=7)), (0, 0, 3))
+        self.assertEqual(self.refresh(self.jokes("pengfu")), (0, 0, 3))
+        self.assertEqual(self.refresh(self.jokes("waduanzi", n_like=7)), (0, 0, 3))
+        self.assertEqual(self.collection.count_documents({}), 3)
+        for document in self.collection.find():
+            self.assertEqual(document["pb_site"], "pengfu")
+            self.assertEqual(document["n_like"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
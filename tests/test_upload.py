@@ -0,0 +1,154 @@
+# coding: utf-8
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkpoint import Checkpoint
+from transport import HttpClient
+from upload import Uploader
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        server = self.server
+        with server.lock:
+            server.requests.append(body)
+            status = server.statuses.pop(0) if server.statuses else 200
+            if status == 200:
+                server.received.append(body)
+        self.send_response(status)
+        self.send_header("content-length", "2")
+        self.end_headers()
+        self.wfile.write("ok")
+
+    def log_message(self, *args):
+        pass
+
+
+class UploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests, self.server.received, self.server.statuses = list(), list(), list()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://127.0.0.1:%s/api/store/joke" % self.server.server_port
+        self.client = HttpClient(pool_maxsize=4)
+        self.directory = tempfile.mkdtemp()
+        self.spool = os.path.join(self.directory, "upload.spool")
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def uploader(self, **kwargs):
+        options = {"workers": 2, "retries": 2, "backoff": 0, "spool": self.spool, "name": "upload_joke"}
+        options.update(kwargs)
+        return Uploader(self.client, self.url, **options)
+
+    def upload(self, payloads, **kwargs):
+        uploader = self.uploader(**kwargs)
+        uploader.start()
+        for payload in payloads:
+            uploader.put(payload)
+        uploader.close()
+        return uploader
+
+    def payloads(self, count):
+        return [{"unique_id": str(i), "title": "joke %s" % i} for i in range(count)]
+
+    def test_sends_each_record(self):
+        uploader = self.upload(self.payloads(10))
+        self.assertEqual(len(self.server.requests), 10)
+        self.assertEqual(sorted(payload["unique_id"] for payload in self.server.received),
+                         [str(i) for i in range(10)])
+        self.assertEqual(uploader.counters, {"sent": 10, "failed": 0, "spooled": 0, "retried": 0})
+        self.assertFalse(os.path.exists(self.spool))
+
+    def test_bulk_posts_batches(self):
+        uploader = self.upload(self.payloads(5), workers=1, batch_size=5, bulk=True)
+        self.assertTrue(1 <= len(self.server.requests) <= 5)
+        self.assertEqual(sorted(payload["unique_id"] for batch in self.server.received for payload in batch),
+                         [str(i) for i in range(5)])
+        self.assertEqual(uploader.counters["sent"], 5)
+
+    def test_retries_server_errors(self):
+        self.server.statuses = [500, 503]
+        uploader = self.upload(self.payloads(1))
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(uploader.counters, {"sent": 1, "failed": 0, "spooled": 0, "retried": 2})
+
+    def test_spools_and_resends(self):
+        self.server.statuses = [500] * 3
+        uploader = self.upload(self.payloads(1))
+        self.assertEqual(uploader.counters, {"sent": 0, "failed": 1, "spooled": 1, "retried": 2})
+        self.assertEqual(self.server.received, list())
+        self.assertTrue(os.path.exists(self.spool))
+        uploader = self.upload([])
+        self.assertEqual(uploader.counters["sent"], 1)
+        self.assertEqual(self.server.received, self.payloads(1))
+        self.assertFalse(os.path.exists(self.spool))
+
+    def test_client_errors_are_not_retried(self):
+        self.server.statuses = [400]
+        uploader = self.upload(self.payloads(1))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(uploader.counters, {"sent": 0, "failed": 1, "spooled": 0, "retried": 0})
+        self.assertFalse(os.path.exists(self.spool))
+
+    def test_connection_errors_are_spooled(self):
+        self.url = "http://127.0.0.1:1/api/store/joke"
+        uploader = self.upload(self.payloads(1), retries=1)
+        self.assertEqual(uploader.counters, {"sent": 0, "failed": 1, "spooled": 1, "retried": 1})
+
+    def test_checkpoint_resends_unconfirmed(self):
+        path = os.path.join(self.directory, "checkpoint.log")
+        checkpoint = Checkpoint(path).load()
+        payloads = self.payloads(3)
+        checkpoint.mark("upload_joke", "0", "queued", payloads[0])
+        checkpoint.mark("upload_joke", "1", "queued", payloads[1])
+        checkpoint.mark("upload_joke", "1", "sent")
+        checkpoint.close()
+        checkpoint = Checkpoint(path).load()
+        uploader = self.upload([payloads[2]], checkpoint=checkpoint)
+        self.assertEqual(sorted(payload["unique_id"] for payload in self.server.received), ["0", "2"])
+        self.assertEqual(uploader.counters["sent"], 2)
+        self.assertEqual(checkpoint.stage("upload_joke", "0")[0], "sent")
+        self.assertEqual(checkpoint.stage("upload_joke", "2")[0], "sent")
+        checkpoint.close()
+
+    def test_spooled_records_are_resent_once(self):
+        path = os.path.join(self.directory, "checkpoint.log")
+        self.server.statuses = [500] * 3
+        checkpoint = Checkpoint(path).load()
+        uploader = self.upload(self.payloads(1), checkpoint=checkpoint)
+        checkpoint.close()
+        self.assertEqual(uploader.counters["spooled"], 1)
+        checkpoint = Checkpoint(path).load()
+        uploader = self.upload([], checkpoint=checkpoint)
+        checkpoint.close()
+        self.assertEqual([payload["unique_id"] for payload in self.server.received], ["0"])
+        self.assertEqual(uploader.counters["sent"], 1)
+        checkpoint = Checkpoint(path).load()
+        uploader = self.upload([], checkpoint=checkpoint)
+        checkpoint.close()
+        self.assertEqual(len(self.server.received), 1)
+        self.assertEqual(uploader.counters["sent"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
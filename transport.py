@@ -0,0 +1,93 @@
+# coding: utf-8
+
+import threading
+import time
+from urlparse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+class NotModified(Exception):
+    pass
+
+
+class HttpClient(object):
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, max_retries=0, cache=None, host_limit=None,
+                 limiter=None):
+        self.cache = cache
+        self.host_limit = host_limit
+        self.limiter = limiter
+        self._lock = threading.Lock()
+        self._hosts = dict()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize,
+                              max_retries=max_retries)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate",
+                                     "Connection": "keep-alive"})
+
+    def _host(self, host):
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.host_limit)
+            return self._hosts[host]
+
+    def _send(self, host, method, url, **kwargs):
+        if not self.limiter:
+            return self.session.request(method, url, **kwargs)
+        self.limiter.acquire(host)
+        start = time.time()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self.limiter.feedback(host, None, time.time() - start)
+            raise
+        self.limiter.feedback(host, response.status_code, time.time() - start,
+                              response.headers.get("Retry-After"))
+        return response
+
+    def request(self, method, url, **kwargs):
+        host = urlparse(url).netloc
+        if not self.host_limit:
+            return self._send(host, method, url, **kwargs)
+        with self._host(host):
+            return self._send(host, method, url, **kwargs)
+
+    def get(self, url, conditional=False, **kwargs):
+        if not (conditional and self.cache):
+            return self.request("GET", url, **kwargs)
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers.update(self.cache.validators(url))
+        response = self.request("GET", url, headers=headers, **kwargs)
+        if response.status_code == 304:
+            self.cache.touch(url)
+        elif response.status_code == 200:
+            self.cache.hold(url, response)
+        return response
+
+    def commit(self, urls):
+        if not self.cache:
+            return
+        for url in urls:
+            self.cache.commit(url)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def default_client():
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = HttpClient()
+        return _default
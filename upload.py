@@ -0,0 +1,166 @@
+# coding: utf-8
+
+import json
+import logging
+import os
+import threading
+import time
+from Queue import Queue, Empty
+from requests.exceptions import ConnectionError, Timeout
+from logqueue import SAMPLE
+from stats import stats
+
+
+class Spool(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, payload):
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(payload) + "\n")
+
+    def drain(self):
+        claimed = "%s.%s" % (self.path, os.getpid())
+        with self._lock:
+            try:
+                os.rename(self.path, claimed)
+            except OSError:
+                return list()
+            with open(claimed) as f:
+                payloads = [json.loads(line) for line in f if line.strip()]
+            os.remove(claimed)
+        return payloads
+
+
+class Uploader(object):
+
+    def __init__(self, client, url, batch_size=20, workers=4, retries=3, backoff=0.5,
+                 timeout=(3, 5), spool=None, bulk=False, queue_size=1000, name=None, checkpoint=None):
+        self.client = client
+        self.url = url
+        self.name = name or url
+        self.batch_size = batch_size
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.spool = Spool(spool) if spool else None
+        self.bulk = bulk
+        self.checkpoint = checkpoint
+        self.counters = {"sent": 0, "failed": 0, "spooled": 0, "retried": 0}
+        self._queue = Queue(maxsize=queue_size)
+        self._threads = list()
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+        stats.count(self.name, name, value)
+
+    def put(self, payload):
+        if payload:
+            if self.checkpoint:
+                self.checkpoint.mark(self.name, payload["unique_id"], "queued", payload)
+            self._queue.put(payload)
+
+    def _mark(self, payloads, stage):
+        if self.checkpoint:
+            self.checkpoint.mark(self.name, [payload["unique_id"] for payload in payloads], stage)
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        pending = self.checkpoint.pending(self.name, "queued") if self.checkpoint else list()
+        spooled = set()
+        if self.spool:
+            payloads = self.spool.drain()
+            if payloads:
+                logging.info("resend %s spooled records to %s" % (len(payloads), self.url))
+            for payload in payloads:
+                spooled.add(payload["unique_id"])
+                self.put(payload)
+        pending = [payload for key, payload in pending if key not in spooled]
+        if pending:
+            logging.info("resend %s unconfirmed records to %s" % (len(pending), self.url))
+        for payload in pending:
+            self._queue.put(payload)
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = list()
+        logging.info("upload %s: %s" % (self.url, self.counters))
+
+    def _batch(self):
+        batch = list()
+        payload = self._queue.get()
+        while payload is not None:
+            batch.append(payload)
+            if len(batch) >= self.batch_size:
+                break
+            try:
+                payload = self._queue.get_nowait()
+            except Empty:
+                break
+        return batch, payload is None
+
+    def _work(self):
+        while True:
+            batch, stop = self._batch()
+            if batch:
+                self._send(batch)
+            if stop:
+                return
+
+    def _send(self, batch):
+        if self.bulk:
+            groups = [(batch, len(batch))]
+        else:
+            groups = [(payload, 1) for payload in batch]
+        for data, size in groups:
+            payloads = data if self.bulk else [data]
+            ok = self._post(data)
+            if ok:
+                self.count("sent", size)
+                self._mark(payloads, "sent")
+                continue
+            self.count("failed", size)
+            if ok is False and self.spool:
+                for payload in payloads:
+                    self.spool.append(payload)
+                self.count("spooled", size)
+                self._mark(payloads, "spooled")
+            else:
+                self._mark(payloads, "failed")
+
+    def _post(self, data):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.count("retried")
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                with stats.timer(self.name, "upload"):
+                    r = self.client.post(self.url, json=data, timeout=self.timeout)
+            except (ConnectionError, Timeout) as e:
+                logging.warn("upload %s error: %s" % (self.url, e))
+                continue
+            except Exception as e:
+                logging.error(e.message)
+                return None
+            if r.status_code >= 500:
+                logging.warn("upload %s status: %s" % (self.url, r.status_code))
+                continue
+            if r.status_code >= 400:
+                logging.error("upload %s status: %s %s" % (self.url, r.status_code, r.content))
+                return None
+            logging.info("upload %s status: %s" % (self.url, r.status_code), extra=SAMPLE)
+            return True
+        return False
@@ -0,0 +1,71 @@
+# coding: utf-8
+
+import logging
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from shard import bucket
+
+
+class WorkQueue(object):
+
+    def __init__(self, collection, lease=600, max_attempts=3, retry_delay=300, buckets=1024):
+        self.collection = collection
+        self.buckets = buckets
+        self.lease = timedelta(seconds=lease)
+        self.max_attempts = max_attempts
+        self.retry_delay = timedelta(seconds=retry_delay)
+
+    def ensure_indexes(self):
+        self.collection.create_index([("status", ASCENDING), ("priority", DESCENDING), ("available", ASCENDING)])
+        self.collection.create_index([("status", ASCENDING), ("lease", ASCENDING)])
+
+    def put(self, joke_id, key, comment_need, priority=0):
+        now = datetime.utcnow()
+        self.collection.update_one(
+            {"_id": str(joke_id)},
+            {"$set": {"key": key, "comment_need": comment_need, "status": "pending",
+                      "priority": priority, "available": now, "updated": now, "attempts": 0,
+                      "bucket": bucket(str(joke_id), self.buckets)},
+             "$setOnInsert": {"created": now}},
+            upsert=True
+        )
+
+    def claim(self, worker, buckets=None, legacy=False):
+        now = datetime.utcnow()
+        query = {"$or": [{"status": "pending", "available": {"$lte": now}},
+                         {"status": "running", "lease": {"$lt": now}}]}
+        if buckets is not None:
+            scope = {"bucket": {"$in": buckets}}
+            if legacy:
+                scope = {"$or": [scope, {"bucket": {"$exists": False}}]}
+            query = {"$and": [query, scope]}
+        return self.collection.find_one_and_update(
+            query,
+            {"$set": {"status": "running", "worker": worker, "lease": now + self.lease},
+             "$inc": {"attempts": 1}},
+            sort=[("priority", DESCENDING), ("available", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def done(self, task):
+        self.collection.update_one(
+            {"_id": task["_id"], "worker": task["worker"]},
+            {"$set": {"status": "done", "updated": datetime.utcnow()}, "$unset": {"lease": ""}}
+        )
+
+    def fail(self, task, error):
+        now = datetime.utcnow()
+        if task.get("attempts", 0) >= self.max_attempts:
+            status, available = "failed", now
+            logging.error("comment task %s failed: %s" % (task["_id"], error))
+        else:
+            status, available = "pending", now + self.retry_delay
+        self.collection.update_one(
+            {"_id": task["_id"], "worker": task["worker"]},
+            {"$set": {"status": status, "available": available, "error": str(error), "updated": now},
+             "$unset": {"lease": ""}}
+        )
+
+    def counts(self):
+        result = self.collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}])
+        return dict((item["_id"], item["count"]) for item in result)